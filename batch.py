@@ -0,0 +1,217 @@
+"""Headless batch research: runs the questions of a JSONL file through the research pipeline.
+
+    python -m batch questions.jsonl answers.jsonl --concurrency 8
+
+Every input line is a job like {"id": "q1", "query": "...", "focus_areas": [...], "constraints": [...]},
+only "query" is required ("mode": "research" or "simple" skips the router). The jobs run on a pool of
+workers in one process, so they share the search cache, the corpus and the plan cache, and a subquery
+of several jobs is fetched once. Each answer is appended to the output file as soon as its job
+finishes. Running the same command again after a crash skips the jobs that already have an answer and
+resumes the failed ones from their checkpoints.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+import contextlib
+from dataclasses import dataclass, field
+from agents import RunConfig
+from clients import clients
+from research_agents import Requirements, lead_agent, planning_agent
+from research_pipeline import run_research, requirements_input
+from hooks import DeepResearchHooks
+from tools import Info
+from memory_service import memory_service
+from search_cache import get_search_cache
+from router import route, SIMPLE
+from settings import getenv
+
+BATCH_CONCURRENCY = int(getenv("BATCH_CONCURRENCY", 4))  # jobs researched at the same time
+BATCH_JOB_TIMEOUT = float(getenv("BATCH_JOB_TIMEOUT", 30 * 60))  # seconds for one job
+BATCH_MAX_TURNS = int(getenv("BATCH_MAX_TURNS", 50))
+BATCH_PROGRESS_INTERVAL = float(getenv("BATCH_PROGRESS_INTERVAL", 30))  # seconds between the progress lines
+
+run_config = RunConfig(workflow_name="Deep Research Batch")
+
+
+def load_jobs(path: str) -> list[dict]:
+    """The jobs of the input file, a job without an id gets its line number."""
+    jobs, ids = [], set()
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if not str(job.get("query", "")).strip():
+                raise ValueError(f"{path}:{number}: the job has no query")
+            job["id"] = str(job.get("id", number))
+            if job["id"] in ids:
+                raise ValueError(f"{path}:{number}: the id {job['id']} is used twice")
+            ids.add(job["id"])
+            jobs.append(job)
+    return jobs
+
+
+def finished_ids(path: str) -> set[str]:
+    """Ids of the jobs with an answer in the output file."""
+    if not os.path.exists(path):
+        return set()
+    finished = set()
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # the last line of a crashed batch can be cut
+            if record.get("status") == "ok":
+                finished.add(str(record["id"]))
+    return finished
+
+
+def job_run_id(job: dict) -> str:
+    """The same job always gets the same run id, so a new attempt resumes from the checkpoints of the failed one."""
+    return hashlib.sha256(f"{job['id']}\n{job['query']}".encode()).hexdigest()[:32]
+
+
+@dataclass
+class Progress:
+    total: int
+    skipped: int = 0
+    done: int = 0
+    failed: int = 0
+    tokens: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def line(self) -> str:
+        finished = self.done + self.failed
+        minutes = (time.monotonic() - self.started_at) / 60
+        jobs_per_minute = finished / minutes if minutes else 0.0
+        remaining = self.total - self.skipped - finished
+        eta = f"{remaining / jobs_per_minute:.0f} min" if jobs_per_minute else "unknown"
+        tokens_per_job = self.tokens / finished if finished else 0
+        return (f"📦 BATCH: {finished}/{self.total - self.skipped} jobs ({self.failed} failed), "
+                f"{jobs_per_minute:.1f} jobs/min, {tokens_per_job:.0f} tokens/job, "
+                f"search cache hit rate {get_search_cache().stats()['hit_rate']:.0%}, ETA {eta}")
+
+
+async def run_job(job: dict, timeout: float = BATCH_JOB_TIMEOUT, max_turns: int = BATCH_MAX_TURNS) -> dict:
+    """Researches one job and returns its output record, a failed job is recorded with its error."""
+    query = job["query"].strip()
+    run_id = job_run_id(job)
+    context = Info(name=job.get("user", "batch"), interests=job.get("interests", []), run_id=run_id)
+    hooks = DeepResearchHooks(run_id)
+    mode = job.get("mode") or ("simple" if route(query).target == SIMPLE else "research")
+    if mode == "simple":
+        starting_agent, input = lead_agent, query
+    else:
+        # Nobody can answer the questions of the Requirement Gathering Agent, the job is planned from its own requirements
+        context.requirements = Requirements(
+            topic=query, focus_areas=job.get("focus_areas", []), constraints=job.get("constraints", [])
+        )
+        starting_agent, input = planning_agent, requirements_input(context.requirements)
+
+    record = {"id": job["id"], "query": query, "mode": mode, "run_id": run_id}
+    started_at = time.monotonic()
+    try:
+        result = await asyncio.wait_for(
+            run_research(starting_agent, input, context, run_config=run_config, hooks=hooks, max_turns=max_turns, resume=True),
+            timeout,
+        )
+        record.update(status="ok", answer=str(result.final_output))
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record.update(
+        duration=round(time.monotonic() - started_at, 2),
+        input_tokens=hooks.input_tokens,
+        output_tokens=hooks.output_tokens,
+    )
+    return record
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = BATCH_CONCURRENCY,
+    timeout: float = BATCH_JOB_TIMEOUT,
+    max_turns: int = BATCH_MAX_TURNS,
+    progress_interval: float = BATCH_PROGRESS_INTERVAL,
+) -> Progress:
+    """Runs the unfinished jobs of the input file on `concurrency` workers and appends their records to the output file."""
+    jobs = load_jobs(input_path)
+    finished = finished_ids(output_path)
+    queue = asyncio.Queue()
+    for job in jobs:
+        if job["id"] not in finished:
+            queue.put_nowait(job)
+    progress = Progress(total=len(jobs), skipped=len(jobs) - queue.qsize())
+    print(f"📦 BATCH: {queue.qsize()} jobs to run, {progress.skipped} already finished", file=sys.stderr)
+
+    # A batch that crashed while writing can leave a cut last line, the next record starts on a new line
+    newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            newline = file.read(1) != b"\n"
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        if newline:
+            output.write("\n")
+
+        async def worker():
+            while not queue.empty():
+                record = await run_job(queue.get_nowait(), timeout, max_turns)
+                # Written and flushed as soon as the job finishes, so a crash loses only the running jobs
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                if record["status"] == "ok":
+                    progress.done += 1
+                else:
+                    progress.failed += 1
+                    print(f"❌ BATCH: job {record['id']} failed: {record['error']}", file=sys.stderr)
+                progress.tokens += record["input_tokens"] + record["output_tokens"]
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_interval)
+                print(progress.line(), file=sys.stderr)
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        finally:
+            reporter.cancel()
+
+    print(progress.line(), file=sys.stderr)
+    return progress
+
+
+async def main(args) -> int:
+    try:
+        progress = await run_batch(args.input, args.output, args.concurrency, args.timeout, args.max_turns, args.progress_interval)
+    finally:
+        # Save the memories that were queued by the jobs and close the connection pools of the clients
+        await memory_service.flush()
+        await clients.aclose()
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the research questions of a JSONL file.")
+    parser.add_argument("input", help="JSONL file of the jobs")
+    parser.add_argument("output", help="JSONL file of the answers, the jobs already in it are skipped")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--timeout", type=float, default=BATCH_JOB_TIMEOUT, help="seconds for one job")
+    parser.add_argument("--max-turns", type=int, default=BATCH_MAX_TURNS)
+    parser.add_argument("--progress-interval", type=float, default=BATCH_PROGRESS_INTERVAL)
+    parser.add_argument("--quiet", action="store_true", help="hide the logs of the agents, only the progress is shown")
+    args = parser.parse_args()
+
+    if args.quiet:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            code = asyncio.run(main(args))
+    else:
+        code = asyncio.run(main(args))
+    sys.exit(code)
@@ -0,0 +1,235 @@
+"""Local stand-ins for Gemini (OpenAI compatible chat completions), Tavily and mem0 used by the benchmarks."""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def tool_names(body: dict) -> list[str]:
+    return [tool["function"]["name"] for tool in body.get("tools", [])]
+
+
+def find_tool(body: dict, *words: str) -> str | None:
+    """Name of the first tool of the request that contains all the words, e.g. the handoff to the planning agent."""
+    for name in tool_names(body):
+        if all(word in name for word in words):
+            return name
+    return None
+
+
+def last_user_text(messages: list[dict]) -> str:
+    for message in reversed(messages):
+        if message["role"] == "user":
+            content = message["content"]
+            return content if isinstance(content, str) else " ".join(part.get("text", "") for part in content)
+    return ""
+
+
+def cited_url(messages: list[dict]) -> str:
+    """A source link of the search results in the messages, so the answers cite what the run retrieved."""
+    for message in reversed(messages):
+        content = message.get("content")
+        match = re.search(r"\((https://example\.com/[0-9a-f]{8}/\d+)\)", content if isinstance(content, str) else "")
+        if match:
+            return match.group(1)
+    return "https://example.com/report"
+
+
+def fake_plan(topic: str, subtasks: int) -> dict:
+    return {
+        "objectives": [f"Understand {topic}"],
+        "subtasks": [
+            {
+                "title": f"Aspect {i + 1} of {topic}",
+                "objective": f"Find the key facts about aspect {i + 1} of {topic}",
+                "queries": [f"{topic} aspect {i + 1}", f"{topic} aspect {i + 1} latest news"],
+            }
+            for i in range(subtasks)
+        ],
+        "methodology": "Web search of every aspect and synthesis of the findings.",
+        "deliverables": ["A report with sources"],
+    }
+
+
+class ScriptedAgents:
+    """Decides the reply of the fake model from the agent (found in the system prompt) and its step.
+
+    The step of an agent is the number of its own tool calls that were already answered, the ids of
+    the tool calls carry the name of the agent that made them.
+    """
+
+    def __init__(self, subtasks: int = 3):
+        self.subtasks = subtasks
+
+    def reply(self, body: dict) -> dict:
+        """Returns {"content": str} or {"tool_call": (name, arguments)}."""
+        messages = body["messages"]
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        match = re.search(r"You are (?:the )?([A-Z][\w ]*?Agent)", system)
+        agent = match.group(1) if match else "Agent"
+        slug = re.sub(r"\W+", "_", agent.lower())
+        step = sum(1 for message in messages if message["role"] == "tool" and message["tool_call_id"].startswith(f"call_{slug}_"))
+        text = last_user_text(messages)
+        topic = " ".join(text.split()[:6]) or "the topic"
+
+        if agent == "DeepSearch Agent" and step == 0:
+            return self._tool(slug, step, find_tool(body, "requirement") or find_tool(body, "lead"), {})
+        if agent == "Requirement Gathering Agent":
+            if step == 0 and find_tool(body, "search_user_memory"):
+                return self._tool(slug, step, "search_user_memory", {"query": topic})
+            requirements = {"topic": text, "focus_areas": ["key facts", "latest news"], "constraints": []}
+            return self._tool(slug, step, find_tool(body, "planning"), requirements)
+        if agent == "Planning Agent":
+            return {"content": json.dumps(fake_plan(topic, self.subtasks))}
+        if agent == "Subtask Research Agent":
+            if step == 0:
+                queries = re.findall(r"^- (.+)$", text, re.MULTILINE) or [topic]
+                return self._tool(slug, step, "web_search_many", {"queries": queries})
+            return {"content": f"{topic} has several findings ([Source]({cited_url(messages)}))."}
+        if agent == "Lead Agent":
+            if step == 0 and "Findings of the subtasks" not in text and body.get("tool_choice") != "none":
+                return self._tool(slug, step, "web_search_many", {"queries": [topic, f"{topic} analysis"]})
+            return {"content": f"## Summary of findings\n{topic} is well covered ([Source]({cited_url(messages)})).\n"}
+        return {"content": f"{agent} done."}
+
+    @staticmethod
+    def _tool(slug: str, step: int, name: str | None, arguments: dict) -> dict:
+        if name is None:
+            return {"content": "No tool available."}
+        return {"tool_call": (f"call_{slug}_{step}_{random.getrandbits(32):08x}", name, json.dumps(arguments))}
+
+
+class FakeChatCompletionsServer:
+    """OpenAI compatible `/v1/chat/completions` HTTP server that replays the scripted agents.
+
+    Every call sleeps `latency` seconds plus `latency_per_1k_tokens` for each 1000 prompt tokens.
+    """
+
+    def __init__(self, latency: float = 0.2, latency_per_1k_tokens: float = 0.0, subtasks: int = 3):
+        self.latency = latency
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.script = ScriptedAgents(subtasks)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = self.prompt_tokens = self.completion_tokens = 0
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt_tokens = estimate_tokens(json.dumps(body["messages"]))
+                reply = fake.script.reply(body)
+                completion_tokens = estimate_tokens(json.dumps(reply))
+                with fake.lock:
+                    fake.calls += 1
+                    fake.prompt_tokens += prompt_tokens
+                    fake.completion_tokens += completion_tokens
+                time.sleep(fake.latency + fake.latency_per_1k_tokens * prompt_tokens / 1000)
+
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+                if "tool_call" in reply:
+                    call_id, name, arguments = reply["tool_call"]
+                    tool_call = {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+                    message, finish_reason = {"role": "assistant", "content": None, "tool_calls": [tool_call]}, "tool_calls"
+                else:
+                    message, finish_reason = {"role": "assistant", "content": reply["content"]}, "stop"
+
+                if body.get("stream"):
+                    self._stream(body["model"], message, finish_reason, usage)
+                else:
+                    self._json({
+                        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                        "model": body["model"], "usage": usage,
+                        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    })
+
+            def _json(self, data: dict):
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, model: str, message: dict, finish_reason: str, usage: dict):
+                def chunk(delta: dict, finish=None, **extra):
+                    data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                            "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}], **extra}
+                    return f"data: {json.dumps(data)}\n\n"
+
+                if "tool_calls" in message:
+                    tool_call = {"index": 0, **message["tool_calls"][0]}
+                    events = [chunk({"role": "assistant", "tool_calls": [tool_call]})]
+                else:
+                    words = re.findall(r"\S+\s*", message["content"])
+                    events = [chunk({"role": "assistant", "content": word}) for word in words]
+                events.append(chunk({}, finish_reason, usage=usage))
+                events.append("data: [DONE]\n\n")
+                payload = "".join(events).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+class FakeTavilyClient:
+    """Stand-in for AsyncTavilyClient, returns deterministic results for every query."""
+
+    def __init__(self, latency: float = 0.3, results: int = 5, content_words: int = 300):
+        self.latency = latency
+        self.results = results
+        self.content_words = content_words
+        self.calls = 0
+
+    async def search(self, query: str, **kwargs) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        digest = hashlib.md5(query.encode()).hexdigest()[:8]
+        words = query.split() or ["topic"]
+        results = []
+        for i in range(self.results):
+            sentences = " ".join(f"{words[j % len(words)].capitalize()} fact {j} of result {i} for {query}." for j in range(self.content_words // 8))
+            results.append({
+                "title": f"{query} - result {i}",
+                "url": f"https://example.com/{digest}/{i}",
+                "content": sentences,
+                "score": 1.0 - i / 10,
+            })
+        return {"query": query, "results": results}
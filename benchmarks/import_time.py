@@ -0,0 +1,52 @@
+"""Measures the cold-start import time of the modules with `python -X importtime`.
+
+    python -m benchmarks.import_time research_agents deep_research_system --runs 5
+"""
+import os
+import sys
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds of every module imported by `import module`, in a new process."""
+    env = dict(os.environ)
+    for name in ("GEMINI_API_KEY", "OPENAI_API_KEY", "TAVILY_API_KEY"):
+        env.setdefault(name, "benchmark")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{process.stderr[-2000:]}")
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.setdefault(name.strip(), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of the modules.")
+    parser.add_argument("modules", nargs="*", default=["research_agents", "deep_research_system"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest packages to show")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        totals = sorted(times[module] for times in runs)
+        print(f"{module}: median {totals[len(totals) // 2] / 1e6:.2f}s, min {totals[0] / 1e6:.2f}s over {args.runs} runs")
+        # Top level packages of the last run, the heaviest first
+        packages = {name: time for name, time in runs[-1].items() if "." not in name and name != module}
+        for name, time in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+            print(f"  {name:<28} {time / 1e6:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
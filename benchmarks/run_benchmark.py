@@ -0,0 +1,197 @@
+"""Offline end-to-end benchmark of the research agents.
+
+Gemini, Tavily and mem0 are replaced by local stand-ins (see fake_backends.py), so no API quota is used.
+The real agents of deep_research_system.py and research_agents.py are driven through complete runs at
+several concurrency levels. Results are saved in benchmarks/results and compared with the previous run.
+
+    python -m benchmarks.run_benchmark --levels 1 8 32 --llm-latency 0.2 --search-latency 0.3
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.fake_backends import FakeChatCompletionsServer, FakeTavilyClient
+
+RESULTS_DIR = Path(__file__).parent / "results"
+# Metrics where a higher value is a regression, and the ones where a lower value is a regression
+HIGHER_IS_WORSE = ["p50_latency", "p95_latency", "llm_calls_per_session", "tool_calls_per_session", "prompt_tokens_per_session"]
+LOWER_IS_WORSE = ["throughput"]
+
+QUERIES = [
+    "Analyze the latest developments in quantum computing",
+    "Summarize recent AI regulations in the European Union",
+    "Compare approaches to sustainable energy generation",
+    "Explain the state of solid state batteries",
+]
+
+
+def setup_environment(server: FakeChatCompletionsServer):
+    """Points the modules to the fake backends, it has to run before they are imported."""
+    os.environ["GEMINI_BASE_URL"] = server.base_url
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["TAVILY_API_KEY"] = "benchmark"
+    os.environ["SEARCH_CACHE_DB"] = ""  # no disk cache, every level starts cold
+    os.environ["CORPUS_DB"] = ""
+    os.environ["CHECKPOINT_DB"] = ""
+    os.environ["TRACE_DIR"] = ""
+    # The limiters of the real APIs would only measure the configured quotas
+    for name in ("GEMINI_RPM", "GEMINI_TPM", "TAVILY_RPM", "MEM0_RPM"):
+        os.environ.setdefault(name, "1000000000")
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else 0.0
+
+
+async def run_session(scenario: str, index: int):
+    from agents import RunConfig
+    from deep_research_system import agent
+    from research_agents import lead_agent
+    from research_pipeline import run_research
+    from hooks import DeepResearchHooks
+    from tools import Info
+
+    hooks = DeepResearchHooks(run_id=f"bench-{scenario}-{index}")
+    starting_agent = agent if scenario == "full" else lead_agent
+    query = f"{QUERIES[index % len(QUERIES)]} (session {index})"
+    started_at = time.perf_counter()
+    await run_research(
+        starting_agent=starting_agent,
+        input=query,
+        context=Info(name=f"bench_user_{index}", interests=["AI"]),
+        run_config=RunConfig(workflow_name="Benchmark", tracing_disabled=True),
+        hooks=hooks,
+        max_turns=50,
+    )
+    return time.perf_counter() - started_at, sum(hooks.tool_usage.values())
+
+
+async def run_level(scenario: str, concurrency: int, sessions: int, server, tavily, verbose: bool) -> dict:
+    from search_cache import get_search_cache
+    from plan_cache import plan_cache
+
+    get_search_cache().memory.entries.clear()
+    plan_cache.entries.clear()
+    plan_cache.matrix = None
+    server.reset_counters()
+    tavily.calls = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index: int):
+        async with semaphore:
+            return await run_session(scenario, index)
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started_at = time.perf_counter()
+    with output:
+        results = await asyncio.gather(*(limited(i) for i in range(sessions)))
+    wall_time = time.perf_counter() - started_at
+
+    latencies = [latency for latency, _ in results]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "wall_time": wall_time,
+        "p50_latency": percentile(latencies, 0.50),
+        "p95_latency": percentile(latencies, 0.95),
+        "throughput": sessions / wall_time * 60,  # sessions per minute
+        "llm_calls_per_session": server.calls / sessions,
+        "tool_calls_per_session": sum(tools for _, tools in results) / sessions,
+        "search_requests_per_session": tavily.calls / sessions,
+        "prompt_tokens_per_session": server.prompt_tokens / sessions,
+    }
+
+
+def compare(current: list[dict], previous: list[dict], threshold: float) -> list[str]:
+    """Lines describing the changes against a previous result, regressions are marked."""
+    previous_by_key = {(row["scenario"], row["concurrency"]): row for row in previous}
+    lines = []
+    for row in current:
+        old = previous_by_key.get((row["scenario"], row["concurrency"]))
+        if not old:
+            continue
+        for metric in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+            if not old.get(metric):
+                continue
+            change = (row[metric] - old[metric]) / old[metric]
+            regression = change > threshold if metric in HIGHER_IS_WORSE else change < -threshold
+            if abs(change) > threshold:
+                mark = "REGRESSION" if regression else "improved"
+                lines.append(f"{row['scenario']:>6} x{row['concurrency']:<3} {metric:<26} "
+                             f"{old[metric]:10.2f} -> {row[metric]:10.2f} ({change:+.0%}) {mark}")
+    return lines
+
+
+def print_table(rows: list[dict]):
+    print(f"{'scenario':>8} {'conc':>5} {'p50 s':>8} {'p95 s':>8} {'runs/min':>9} {'llm':>6} {'tools':>6} {'search':>7} {'prompt tok':>11}")
+    for row in rows:
+        print(f"{row['scenario']:>8} {row['concurrency']:>5} {row['p50_latency']:8.2f} {row['p95_latency']:8.2f} "
+              f"{row['throughput']:9.1f} {row['llm_calls_per_session']:6.1f} {row['tool_calls_per_session']:6.1f} "
+              f"{row['search_requests_per_session']:7.1f} {row['prompt_tokens_per_session']:11.0f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Deep Research agents.")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32], help="concurrent sessions to measure")
+    parser.add_argument("--sessions", type=int, default=None, help="sessions per level (default: the level)")
+    parser.add_argument("--scenarios", nargs="+", default=["full", "direct"], choices=["full", "direct"],
+                        help="full: DeepSearch Agent with the whole workflow, direct: Lead Agent only")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--llm-latency-per-1k", type=float, default=0.01, help="extra seconds per 1000 prompt tokens")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="seconds per fake Tavily search")
+    parser.add_argument("--subtasks", type=int, default=3, help="subtasks in the fake research plans")
+    parser.add_argument("--compare", type=Path, default=None, help="result file to compare with (default: the latest)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change reported as a regression")
+    parser.add_argument("--no-save", action="store_true", help="do not store the result")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the agents")
+    args = parser.parse_args()
+
+    server = FakeChatCompletionsServer(args.llm_latency, args.llm_latency_per_1k, args.subtasks).start()
+    setup_environment(server)
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+    from agents import set_tracing_disabled
+    from clients import clients
+    from memory_service import LocalMemoryBackend
+
+    set_tracing_disabled(True)
+    tavily = FakeTavilyClient(latency=args.search_latency)
+    clients.override("tavily", tavily)
+    clients.override("mem0", LocalMemoryBackend())
+
+    rows = []
+    try:
+        for scenario in args.scenarios:
+            for level in args.levels:
+                rows.append(await run_level(scenario, level, args.sessions or level, server, tavily, args.verbose))
+                print(f"measured {scenario} x{level}")
+    finally:
+        server.stop()
+
+    print_table(rows)
+
+    previous_file = args.compare or max(RESULTS_DIR.glob("*.json"), default=None)
+    if previous_file:
+        previous = json.loads(Path(previous_file).read_text())
+        print(f"\nCompared with {previous_file}:")
+        print("\n".join(compare(rows, previous["results"], args.threshold)) or "no change above the threshold")
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+        path.write_text(json.dumps({"arguments": {k: str(v) for k, v in vars(args).items()}, "results": rows}, indent=2))
+        print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+"""Budget of a research run: a wall-clock deadline, a token spend and a number of searches.
+
+The share of the budget a run has spent is the highest of the three. As it grows the research degrades
+step by step instead of wandering on or failing:
+
+1. FLASH: the Lead Agent answers with the flash model instead of the pro one (DegradableModel)
+2. NO_OPTIONAL: the reflect tool and the Citation Agent are not used anymore
+3. NO_SEARCH: the search tools stop searching and ask the agent to answer from what it has
+4. EXHAUSTED: the LLM calls of the run are stopped by BudgetHooks, and research_pipeline forces a
+   synthesis of what was gathered
+"""
+import time
+import contextvars
+from agents import Agent, Model, RunContextWrapper, RunHooks
+from agents.exceptions import AgentsException
+from settings import getenv
+
+# 0 disables a limit
+RUN_DEADLINE = float(getenv("RUN_DEADLINE", 15 * 60))  # seconds
+RUN_MAX_TOKENS = int(getenv("RUN_MAX_TOKENS", 1_000_000))
+RUN_MAX_SEARCHES = int(getenv("RUN_MAX_SEARCHES", 80))
+# Shares of the budget spent at which the research degrades
+BUDGET_FLASH_AT = float(getenv("BUDGET_FLASH_AT", 0.5))
+BUDGET_NO_OPTIONAL_AT = float(getenv("BUDGET_NO_OPTIONAL_AT", 0.7))
+BUDGET_NO_SEARCH_AT = float(getenv("BUDGET_NO_SEARCH_AT", 0.9))
+
+FULL, FLASH, NO_OPTIONAL, NO_SEARCH, EXHAUSTED = range(5)
+STAGES = {
+    FULL: "full research",
+    FLASH: "the Lead Agent switches to the flash model",
+    NO_OPTIONAL: "reflection and citation agents disabled",
+    NO_SEARCH: "new searches stopped",
+    EXHAUSTED: "budget exhausted, forcing the synthesis",
+}
+
+SEARCH_STOPPED = ("The search budget of this research is spent, no new searches are run. "
+                  "Answer from the information you already gathered.")
+
+
+class BudgetExhausted(AgentsException):
+    """Raised at the next LLM call of a run that spent its whole budget."""
+
+
+class Budget:
+    """The budget of one run and what it spent so far."""
+
+    def __init__(self, deadline: float = RUN_DEADLINE, max_tokens: int = RUN_MAX_TOKENS, max_searches: int = RUN_MAX_SEARCHES):
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.max_searches = max_searches
+        self.started_at = time.monotonic()
+        self.tokens = 0
+        self.searches = 0
+        self.stage = FULL
+
+    def spent(self, searches: bool = True) -> float:
+        """Share of the budget spent, the highest of the time, the tokens and the searches."""
+        shares = []
+        if self.deadline:
+            shares.append((time.monotonic() - self.started_at) / self.deadline)
+        if self.max_tokens:
+            shares.append(self.tokens / self.max_tokens)
+        if self.max_searches and searches:
+            shares.append(self.searches / self.max_searches)
+        return max(shares, default=0.0)
+
+    def update(self) -> int:
+        """The stage of the run for the budget spent. The stages only go forward, a run never upgrades again."""
+        spent = self.spent()
+        thresholds = [(1.0, EXHAUSTED), (BUDGET_NO_SEARCH_AT, NO_SEARCH), (BUDGET_NO_OPTIONAL_AT, NO_OPTIONAL), (BUDGET_FLASH_AT, FLASH)]
+        stage = next((stage for threshold, stage in thresholds if spent >= threshold), FULL)
+        # Running out of searches only stops the searches, the agents can still answer
+        if stage == EXHAUSTED and self.spent(searches=False) < 1.0:
+            stage = NO_SEARCH
+        if stage > self.stage:
+            self.stage = stage
+            print(f"💰 SYSTEM: {spent:.0%} of the run budget spent, {STAGES[stage]}")
+        return self.stage
+
+    def remaining_time(self) -> float | None:
+        if not self.deadline:
+            return None
+        return max(0.0, self.deadline - (time.monotonic() - self.started_at))
+
+    def charge_tokens(self, tokens: int):
+        self.tokens += tokens
+        self.update()
+
+    def charge_searches(self, count: int) -> int:
+        """Counts the searches a tool is about to run and returns how many of them it may run."""
+        if self.update() >= NO_SEARCH:
+            return 0
+        allowed = count if not self.max_searches else max(0, min(count, self.max_searches - self.searches))
+        self.searches += allowed
+        return allowed
+
+    def refund_searches(self, count: int):
+        self.searches = max(0, self.searches - count)
+
+    def summary(self) -> str:
+        return (f"{time.monotonic() - self.started_at:.0f}s, {self.tokens} tokens, {self.searches} searches "
+                f"({self.spent():.0%} spent, {STAGES[self.stage]})")
+
+
+# Budget of the research run in progress, set by research_pipeline.run_research
+run_budget: contextvars.ContextVar[Budget | None] = contextvars.ContextVar("run_budget", default=None)
+
+
+def budget_stage() -> int:
+    budget = run_budget.get()
+    return budget.update() if budget else FULL
+
+
+def allow_searches(count: int) -> int:
+    """How many of `count` searches a tool may run, all of them outside a run with a budget."""
+    budget = run_budget.get()
+    return budget.charge_searches(count) if budget else count
+
+
+def refund_searches(count: int):
+    """Gives back searches that were charged twice, e.g. a prefetched search the tool charged again."""
+    budget = run_budget.get()
+    if budget:
+        budget.refund_searches(count)
+
+
+def optional_work_enabled(Wrapper: RunContextWrapper, agent: Agent) -> bool:
+    """`is_enabled` of the optional tools, like the reflect tool of the Lead Agent."""
+    return budget_stage() < NO_OPTIONAL
+
+
+class DegradableModel(Model):
+    """Model of an agent that switches to a cheaper model once the run reaches the FLASH stage of its budget."""
+
+    def __init__(self, model: Model, fallback: Model):
+        self.model = model
+        self.fallback = fallback
+
+    def current(self) -> Model:
+        return self.fallback if budget_stage() >= FLASH else self.model
+
+    async def get_response(self, *args, **kwargs):
+        return await self.current().get_response(*args, **kwargs)
+
+    def stream_response(self, *args, **kwargs):
+        return self.current().stream_response(*args, **kwargs)
+
+
+class BudgetHooks(RunHooks):
+    """Charges the tokens of every LLM call to the budget and stops the run at the next call once it is
+    exhausted. The events are passed on to the hooks of the caller."""
+
+    def __init__(self, budget: Budget, hooks: RunHooks | None = None):
+        self.budget = budget
+        self.hooks = hooks or RunHooks()
+
+    async def on_llm_start(self, context, agent, system_prompt, input_items):
+        if self.budget.update() == EXHAUSTED:
+            raise BudgetExhausted(f"Run budget exhausted: {self.budget.summary()}")
+        await self.hooks.on_llm_start(context, agent, system_prompt, input_items)
+
+    async def on_llm_end(self, context, agent, response):
+        self.budget.charge_tokens(response.usage.total_tokens)
+        await self.hooks.on_llm_end(context, agent, response)
+
+    async def on_agent_start(self, context, agent):
+        await self.hooks.on_agent_start(context, agent)
+
+    async def on_agent_end(self, context, agent, output):
+        await self.hooks.on_agent_end(context, agent, output)
+
+    async def on_handoff(self, context, from_agent, to_agent):
+        await self.hooks.on_handoff(context, from_agent, to_agent)
+
+    async def on_tool_start(self, context, agent, tool):
+        await self.hooks.on_tool_start(context, agent, tool)
+
+    async def on_tool_end(self, context, agent, tool, result):
+        await self.hooks.on_tool_end(context, agent, tool, result)
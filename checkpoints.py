@@ -0,0 +1,153 @@
+"""Checkpoints of the stages of a research run, so a failed run can resume instead of starting over.
+
+Keyed by the run id of the context (`Info.run_id`), a run records the requirements handed to the Planning
+Agent, the plan, the summary of every finished subtask and the output of every search tool call. The
+checkpoints of a run are deleted when it completes, and the ones of runs that were never resumed after
+CHECKPOINT_MAX_AGE seconds.
+"""
+import json
+import time
+import sqlite3
+import asyncio
+import functools
+import threading
+import contextvars
+from dataclasses import dataclass, field
+from settings import getenv
+
+CHECKPOINT_DB = getenv("CHECKPOINT_DB", "checkpoints.db")  # empty value disables the checkpoints
+CHECKPOINT_MAX_AGE = float(getenv("CHECKPOINT_MAX_AGE", 24 * 60 * 60))  # seconds a failed run can be resumed
+
+
+@dataclass
+class Checkpoint:
+    """The stages a run finished before it failed."""
+
+    run_id: str
+    requirements: dict | None = None
+    plan: dict | None = None
+    subtasks: dict[str, str] = field(default_factory=dict)  # title -> summary of the finished subtasks
+    tool_outputs: list = field(default_factory=list)  # outputs of the checkpointed tool calls
+    history_saved: bool = False  # the message of the user was already saved in the session
+
+
+class CheckpointStore:
+    """SQLite store of the checkpoints. The methods are blocking, they are called in a worker thread."""
+
+    def __init__(self, db_path: str = CHECKPOINT_DB, max_age: float = CHECKPOINT_MAX_AGE):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS checkpoints (
+                run_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (run_id, stage, key)
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_checkpoints_created ON checkpoints (created_at)")
+        self.conn.commit()
+        self.replayed = 0
+
+    def save(self, run_id: str, stage: str, value, key: str = ""):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (run_id, stage, key, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                (run_id, stage, key, json.dumps(value), time.time()),
+            )
+            self.conn.commit()
+
+    def load(self, run_id: str) -> Checkpoint | None:
+        with self.lock:
+            rows = self.conn.execute("SELECT stage, key, value FROM checkpoints WHERE run_id = ?", (run_id,)).fetchall()
+        if not rows:
+            return None
+        checkpoint = Checkpoint(run_id)
+        for stage, key, value in rows:
+            value = json.loads(value)
+            if stage == "requirements":
+                checkpoint.requirements = value
+            elif stage == "plan":
+                checkpoint.plan = value
+            elif stage == "subtask":
+                checkpoint.subtasks[key] = value
+            elif stage == "tool":
+                checkpoint.tool_outputs.append(value)
+            elif stage == "history":
+                checkpoint.history_saved = value
+        return checkpoint
+
+    def tool_output(self, run_id: str, key: str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM checkpoints WHERE run_id = ? AND stage = 'tool' AND key = ?", (run_id, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def complete(self, run_id: str):
+        """Deletes the checkpoints of a finished run, and the expired ones of the other runs."""
+        with self.lock:
+            self.conn.execute("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))
+            self.conn.commit()
+        self.gc()
+
+    def gc(self) -> int:
+        """Deletes the checkpoints of the runs that were not resumed within `max_age` seconds."""
+        with self.lock:
+            deleted = self.conn.execute(
+                """DELETE FROM checkpoints WHERE run_id IN (
+                    SELECT run_id FROM checkpoints GROUP BY run_id HAVING MAX(created_at) < ?
+                )""",
+                (time.time() - self.max_age,),
+            ).rowcount
+            self.conn.commit()
+        return deleted
+
+
+@functools.cache
+def get_checkpoints() -> CheckpointStore | None:
+    """One store for the whole process, opened on first use. None when the checkpoints are disabled."""
+    return CheckpointStore() if CHECKPOINT_DB else None
+
+# Run id of the research run in progress, set by research_pipeline.run_research. The agents run in tasks
+# created by the run, so the tools see the value of their run.
+current_run_id: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_run_id", default=None)
+
+
+async def save_stage(stage: str, value, key: str = ""):
+    """Checkpoints a stage of the run in progress, nothing is saved outside a run with a run id."""
+    run_id = current_run_id.get()
+    checkpoints = get_checkpoints() if run_id else None
+    if checkpoints:
+        await asyncio.to_thread(checkpoints.save, run_id, stage, value, key)
+
+
+def checkpointed(func=None, *, complete=None):
+    """Tool decorator: in a run with a run id the output of every call is checkpointed, and when the run
+    is resumed a call with the same arguments returns the checkpointed output instead of running again.
+    `complete(output)` is False for an output that must run again, e.g. one with failed searches."""
+    if func is None:
+        return functools.partial(checkpointed, complete=complete)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        run_id = current_run_id.get()
+        checkpoints = get_checkpoints() if run_id else None
+        if checkpoints is None:
+            return await func(*args, **kwargs)
+        key = f"{func.__name__}:{json.dumps([args, kwargs], sort_keys=True, default=str)}"
+        output = await asyncio.to_thread(checkpoints.tool_output, run_id, key)
+        if output is not None:
+            checkpoints.replayed += 1
+            print(f"♻️ SYSTEM: replayed the checkpointed output of {func.__name__}")
+            return output
+        output = await func(*args, **kwargs)
+        if complete is None or complete(output):
+            await asyncio.to_thread(checkpoints.save, run_id, "tool", output, key)
+        return output
+
+    return wrapper
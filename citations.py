@@ -0,0 +1,143 @@
+"""Local verification of the citations of the final answer against the sources the run actually retrieved.
+
+Every link of the answer must point to a URL returned by a search of the run: unsupported links are
+stripped (their text is kept), and a claim without a link gets the source whose content overlaps it most.
+The Citation Agent is only asked to fix the answer when too many claims are still without a source.
+"""
+import re
+import contextvars
+from dataclasses import dataclass
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from compaction import tokenize
+from plan_cache import STOPWORDS
+from settings import getenv
+
+CITATION_MIN_OVERLAP = float(getenv("CITATION_MIN_OVERLAP", 0.5))  # share of a claim's words a source must contain
+CITATION_MAX_UNCITED = float(getenv("CITATION_MAX_UNCITED", 0.5))  # above it the Citation Agent fixes the answer
+CLAIM_MIN_WORDS = 8  # shorter sentences are not treated as claims that need a source
+
+# The URL can contain balanced parentheses, e.g. https://en.wikipedia.org/wiki/Python_(programming_language)
+LINK = re.compile(r"\[([^\]]*)\]\((https?://(?:[^\s()]|\([^\s()]*\))+)\)")
+DROPPED = "\x00"  # marks a dropped link until its empty parentheses are removed
+SOURCE_BLOCK = re.compile(r"^### (.*)\n(.*?)\n##### \[Source\]\((\S+)\)", re.MULTILINE | re.DOTALL)
+
+# url -> search result of the run in progress, set by research_pipeline.run_research. The dict is shared
+# with the tasks of the agents, so the searches of every agent of the run add to it.
+run_sources: contextvars.ContextVar[dict | None] = contextvars.ContextVar("run_sources", default=None)
+
+
+@dataclass
+class CitationReport:
+    supported: int = 0  # links to a retrieved source
+    stripped: int = 0  # links to a URL that was never retrieved
+    attached: int = 0  # sources added to claims without a link
+    claims: int = 0
+    uncited: int = 0  # claims still without a source
+
+    @property
+    def failed(self) -> bool:
+        return self.claims > 0 and self.uncited / self.claims > CITATION_MAX_UNCITED
+
+
+def normalize_url(url: str) -> str:
+    """Same URL for small differences: scheme, www, case of the host, trailing slash, fragment and tracking parameters."""
+    parts = urlsplit(url.strip().rstrip(".,;"))
+    host = parts.netloc.lower().removeprefix("www.")
+    query = urlencode([(key, value) for key, value in parse_qsl(parts.query) if not key.startswith("utm_")])
+    return urlunsplit(("", host, parts.path.rstrip("/"), query, ""))
+
+
+def record_sources(results: list[dict]):
+    """Adds the results of a search to the sources of the run in progress."""
+    sources = run_sources.get()
+    if sources is None:
+        return
+    for result in results:
+        if result.get("url"):
+            sources[normalize_url(result["url"])] = result
+
+
+def parse_formatted_results(text: str) -> list[dict]:
+    """The results back from the output of the search tools (web_search.format_results), e.g. a checkpointed one."""
+    return [
+        {"title": title.strip(), "content": content.strip(), "url": url}
+        for title, content, url in SOURCE_BLOCK.findall(text)
+    ]
+
+
+def claim_terms(text: str) -> set[str]:
+    return {term for term in tokenize(LINK.sub(r"\1", text)) if term not in STOPWORDS and len(term) > 2}
+
+
+def best_source(sentence: str, source_terms: list[tuple[dict, set[str]]]) -> dict | None:
+    """The source whose title and content contain most of the words of the sentence, if enough of them."""
+    words = claim_terms(sentence)
+    if not words:
+        return None
+    best, best_overlap = None, 0.0
+    for source, terms in source_terms:
+        overlap = len(words & terms) / len(words)
+        if overlap > best_overlap:
+            best, best_overlap = source, overlap
+    return best if best_overlap >= CITATION_MIN_OVERLAP else None
+
+
+def verify_citations(markdown: str, sources: dict) -> tuple[str, CitationReport]:
+    """Checks every link of the answer against the retrieved sources, returns the fixed answer and a report."""
+    report = CitationReport()
+    source_terms = [
+        (source, claim_terms(f"{source.get('title', '')} {source.get('content', '')}")) for source in sources.values()
+    ]
+
+    def check_link(match: re.Match) -> str:
+        text, url = match.groups()
+        if normalize_url(url) in sources:
+            report.supported += 1
+            return match.group(0)
+        report.stripped += 1
+        # A bare "[Source](url)" is dropped, the text of a link in a sentence is kept
+        return DROPPED if text.strip().lower() in ("", "source", "sources", "link") else text
+
+    lines = []
+    in_code = False
+    for line in markdown.split("\n"):
+        if line.strip().startswith("```"):
+            in_code = not in_code
+        if in_code or not line.strip():
+            lines.append(line)
+            continue
+        # A dropped "([Source](url))" leaves empty parentheses
+        line = re.sub(rf"\s*\(\s*{DROPPED}\s*\)", "", LINK.sub(check_link, line)).replace(DROPPED, "")
+        if line.lstrip().startswith(("#", "|", ">")):
+            lines.append(line)
+            continue
+        # Claims are the long sentences of the paragraphs and list items
+        sentences = re.split(r"(?<=[.!?])\s+(?=[A-Z0-9*\[])", line)
+        for index, sentence in enumerate(sentences):
+            if len(sentence.split()) < CLAIM_MIN_WORDS:
+                continue
+            report.claims += 1
+            if LINK.search(sentence):
+                continue
+            source = best_source(sentence, source_terms)
+            if source is None:
+                report.uncited += 1
+                continue
+            report.attached += 1
+            end = len(sentence.rstrip()) - (1 if sentence.rstrip()[-1:] in ".!?" else 0)
+            sentences[index] = f"{sentence[:end]} ([Source]({source['url']})){sentence[end:]}"
+        lines.append(" ".join(sentences))
+    return "\n".join(lines), report
+
+
+def sources_input(answer: str, sources: dict) -> str:
+    """Input of the Citation Agent when the local verification failed."""
+    listed = "\n".join(f"- [{source.get('title', url)}]({source['url']})" for url, source in list(sources.items())[:40])
+    return f"""Add a markdown link to a supporting source after every factual claim of the answer below.
+Use only the sources listed here and do not change the content of the answer. Reply with the corrected answer only.
+
+## Sources
+{listed}
+
+## Answer
+{answer}"""
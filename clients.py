@@ -0,0 +1,115 @@
+"""Registry of the clients of the external services (Gemini, Tavily and mem0).
+
+Every client is created on its first use with its package imported only then, so importing the
+agents does not connect to anything.
+Each backend has one client for the whole process, which keeps one pool of HTTP connections.
+"""
+import inspect
+import functools
+from agents.models.interface import Model
+from settings import getenv
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/openai/"
+
+
+# Connections kept open to Gemini, shared by every agent and chat of the process
+GEMINI_MAX_CONNECTIONS = int(getenv("GEMINI_MAX_CONNECTIONS", 20))
+
+
+def require_env(name: str) -> str:
+    value = getenv(name)
+    if not value:
+        raise ValueError(f"{name} is not set. Please ensure it is defined in your .env file.")
+    return value
+
+
+def create_gemini_client():
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    # The OpenAI key is only used to export the traces of the runs
+    require_env("OPENAI_API_KEY")
+    return AsyncOpenAI(
+        api_key=require_env("GEMINI_API_KEY"),
+        base_url=getenv("GEMINI_BASE_URL", GEMINI_BASE_URL),
+        timeout=30.0,
+        max_retries=0,  # retries are done by the shared rate limiter with backoff
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=GEMINI_MAX_CONNECTIONS, max_keepalive_connections=GEMINI_MAX_CONNECTIONS)
+        ),
+    )
+
+
+def create_tavily_client():
+    from tavily import AsyncTavilyClient
+
+    return AsyncTavilyClient(api_key=require_env("TAVILY_API_KEY"))
+
+
+def create_mem0_client():
+    """The mem0 client when MEM0_API_KEY is set, otherwise the local stand-in."""
+    mem0_api_key = getenv("MEM0_API_KEY")
+    if not mem0_api_key:
+        from memory_service import LocalMemoryBackend
+
+        print("MEM0_API_KEY is not set, memories are kept in the local memory backend.")
+        return LocalMemoryBackend()
+    from mem0 import MemoryClient
+
+    return MemoryClient(api_key=mem0_api_key)
+
+
+class ClientRegistry:
+    """The clients of the process by backend name, each created by its factory on first use."""
+
+    def __init__(self):
+        self.factories = {
+            "gemini": create_gemini_client,
+            "tavily": create_tavily_client,
+            "mem0": create_mem0_client,
+        }
+        self.clients = {}
+
+    def get(self, name: str):
+        client = self.clients.get(name)
+        if client is None:
+            client = self.clients[name] = self.factories[name]()
+        return client
+
+    def override(self, name: str, client):
+        """Replaces the client of a backend, e.g. with a fake one in the benchmarks."""
+        self.clients[name] = client
+
+    async def aclose(self):
+        """Closes the HTTP connection pools of the clients that were created."""
+        for client in self.clients.values():
+            close = getattr(client, "close", None)
+            if inspect.iscoroutinefunction(close):
+                await close()
+        self.clients.clear()
+
+
+clients = ClientRegistry()
+
+
+class LazyChatModel(Model):
+    """Chat completions model on the shared Gemini client, created on the first call."""
+
+    def __init__(self, model_name: str, client_name: str = "gemini"):
+        self.model_name = model_name
+        self.client_name = client_name
+        self._model = None
+
+    @property
+    def model(self) -> Model:
+        if self._model is None:
+            from agents import OpenAIChatCompletionsModel
+
+            self._model = OpenAIChatCompletionsModel(model=self.model_name, openai_client=clients.get(self.client_name))
+        return self._model
+
+    async def get_response(self, *args, **kwargs):
+        return await self.model.get_response(*args, **kwargs)
+
+    def stream_response(self, *args, **kwargs):
+        return self.model.stream_response(*args, **kwargs)
@@ -0,0 +1,167 @@
+import re
+import json
+import math
+import zlib
+import random
+from collections import Counter
+from settings import getenv
+
+# Maximum tokens of search content that is given to the model for one query, 0 disables the compaction
+SEARCH_TOKEN_BUDGET = int(getenv("SEARCH_TOKEN_BUDGET", 1500))
+# Passages with an estimated similarity above this value are treated as duplicates
+DUPLICATE_THRESHOLD = float(getenv("SEARCH_DUPLICATE_THRESHOLD", 0.7))
+
+PASSAGE_WORDS = 60
+NUM_HASHES = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(17)
+_HASH_PARAMS = [(_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_HASHES)]
+
+
+def estimate_tokens(value) -> int:
+    """Rough token count, about 4 characters per token for English text. A value that is not a
+    string (e.g. a history item or the input of a model) is counted as its JSON."""
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return math.ceil(len(text) / 4)
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def split_passages(content: str, max_words: int = PASSAGE_WORDS) -> list[str]:
+    """Splits the content in passages of whole sentences with about `max_words` words each.
+    A sentence longer than `max_words` (e.g. content without punctuation) is cut every `max_words` words."""
+    sentences = re.split(r"(?<=[.!?])\s+|\n+", content)
+    passages, current, words = [], [], 0
+    for sentence in sentences:
+        sentence_words = sentence.split()
+        if not sentence_words:
+            continue
+        if len(sentence_words) > max_words:
+            if current:
+                passages.append(" ".join(current))
+                current, words = [], 0
+            passages.extend(" ".join(sentence_words[i:i + max_words]) for i in range(0, len(sentence_words), max_words))
+            continue
+        sentence = " ".join(sentence_words)
+        current.append(sentence)
+        words += len(sentence.split())
+        if words >= max_words:
+            passages.append(" ".join(current))
+            current, words = [], 0
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """The first words of the text that fit in `max_tokens`."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for word in text.split():
+        used += estimate_tokens(word + " ")
+        if used > max_tokens and kept:
+            break
+        kept.append(word)
+    return " ".join(kept) + " …"
+
+
+def bm25_scores(query: str, documents: list[list[str]], k1: float = 1.5, b: float = 0.75) -> list[float]:
+    """Scores the tokenized documents against the query with Okapi BM25."""
+    if not documents:
+        return []
+    avg_length = sum(len(doc) for doc in documents) / len(documents) or 1
+    document_frequency = Counter(term for doc in documents for term in set(doc))
+    query_terms = set(tokenize(query))
+    scores = []
+    for doc in documents:
+        frequencies = Counter(doc)
+        score = 0.0
+        for term in query_terms:
+            frequency = frequencies.get(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def minhash(tokens: list[str], shingle_size: int = 3) -> list[int]:
+    """MinHash signature of the word shingles of a passage."""
+    shingles = {" ".join(tokens[i:i + shingle_size]) for i in range(max(1, len(tokens) - shingle_size + 1))}
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingles]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _HASH_PARAMS]
+
+
+def similarity(signature_a: list[int], signature_b: list[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / len(signature_a)
+
+
+def compact_results(query: str, results: list[dict], token_budget: int = SEARCH_TOKEN_BUDGET) -> tuple[list[dict], dict]:
+    """Keeps only the passages of the results that are most relevant to the query, within the token budget.
+
+    Every result keeps at least its best passage, truncated if needed, so the source link of each
+    result survives. Returns the compacted results (same keys as the Tavily results, in their
+    original order) and the stats of the compaction.
+    """
+    original_tokens = sum(estimate_tokens(result['content']) for result in results)
+    if token_budget <= 0 or original_tokens <= token_budget:
+        return results, {"original_tokens": original_tokens, "compacted_tokens": original_tokens, "saved_tokens": 0}
+
+    # (result index, passage index, text, tokens)
+    passages = []
+    for result_index, result in enumerate(results):
+        for passage_index, text in enumerate(split_passages(result['content'])):
+            passages.append((result_index, passage_index, text, tokenize(text)))
+
+    scores = bm25_scores(query, [tokens for *_, tokens in passages])
+    ranked = sorted(range(len(passages)), key=lambda i: scores[i], reverse=True)
+    # Passages without any query term are dropped, unless nothing matched the query at all
+    if scores and max(scores) > 0:
+        ranked = [i for i in ranked if scores[i] > 0]
+
+    # Every result first gets its best passage (the first one when none matched), cut to its share of the budget
+    selected, signatures, used_tokens = [], [], 0
+    best = {}
+    for i in ranked + list(range(len(passages))):
+        best.setdefault(passages[i][0], i)
+    share = max(1, token_budget // len(results))
+    first = set(best.values())
+    for i in first:
+        result_index, passage_index, text, tokens = passages[i]
+        text = truncate(text, share)
+        selected.append((result_index, passage_index, text))
+        signatures.append(minhash(tokens))
+        used_tokens += estimate_tokens(text)
+
+    for i in ranked:
+        if i in first:
+            continue
+        result_index, passage_index, text, tokens = passages[i]
+        cost = estimate_tokens(text)
+        if used_tokens + cost > token_budget:
+            continue
+        # Skip the passages that repeat an already selected passage (often the same news on several sites)
+        signature = minhash(tokens)
+        if any(similarity(signature, other) >= DUPLICATE_THRESHOLD for other in signatures):
+            continue
+        selected.append((result_index, passage_index, text))
+        signatures.append(signature)
+        used_tokens += cost
+
+    compacted = []
+    for result_index, result in enumerate(results):
+        texts = [text for index, _, text in sorted(selected) if index == result_index]
+        if texts:
+            compacted.append({**result, "content": " … ".join(texts)})
+
+    compacted_tokens = sum(estimate_tokens(result['content']) for result in compacted)
+    return compacted, {
+        "original_tokens": original_tokens,
+        "compacted_tokens": compacted_tokens,
+        "saved_tokens": original_tokens - compacted_tokens,
+    }
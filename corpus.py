@@ -0,0 +1,349 @@
+"""Local corpus of every search result the agents retrieved, so a later search can be answered without Tavily.
+
+The documents live in SQLite with a BM25 inverted index (`postings`), and optionally a dense vector per
+document (hashed words and bigrams) in a memory-mapped NumPy matrix that re-ranks the BM25 candidates.
+
+    python -m corpus stats
+    python -m corpus search "solid state batteries"
+    python -m corpus compact    # drops old documents and frees their space
+    python -m corpus rebuild    # rebuilds the index and the vectors from the documents, offline
+"""
+import os
+import sys
+import math
+import time
+import zlib
+import functools
+import sqlite3
+import threading
+from collections import Counter
+import numpy as np
+from compaction import tokenize
+from plan_cache import STOPWORDS
+from instrumentation import metric_lines, exposition_text
+from settings import getenv
+
+CORPUS_DB = getenv("CORPUS_DB", "corpus.db")  # empty value disables the corpus
+CORPUS_VECTORS = getenv("CORPUS_VECTORS", "corpus_vectors.f32")  # empty value disables the dense vectors
+CORPUS_MAX_AGE = float(getenv("CORPUS_MAX_AGE", 24 * 60 * 60))  # seconds a stored result can answer a search
+CORPUS_MIN_COVERAGE = float(getenv("CORPUS_MIN_COVERAGE", 0.75))  # share of the query words a result must contain
+CORPUS_MIN_RESULTS = int(getenv("CORPUS_MIN_RESULTS", 3))  # fresh and relevant results needed to skip Tavily
+CORPUS_RETENTION = float(getenv("CORPUS_RETENTION", 30 * 24 * 60 * 60))  # compaction drops older documents
+CORPUS_MAX_DOCUMENTS = int(getenv("CORPUS_MAX_DOCUMENTS", 50000))
+VECTOR_DIM = 256
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def terms(text: str) -> list[str]:
+    return [term for term in tokenize(text) if term not in STOPWORDS]
+
+
+def embed(text: str, dim: int = VECTOR_DIM) -> np.ndarray:
+    """Normalized vector of the hashed words and word bigrams of the text."""
+    words = terms(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    for gram in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        vector[zlib.crc32(gram.encode()) % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorStore:
+    """Dense vectors of the documents in a memory-mapped float32 matrix, one row per document."""
+
+    def __init__(self, path: str, dim: int = VECTOR_DIM):
+        self.path = path
+        self.dim = dim
+        self.matrix = None
+        self.inode = None
+        self._map(self._file_rows())
+
+    def _file_rows(self) -> int:
+        return os.path.getsize(self.path) // (self.dim * 4) if os.path.exists(self.path) else 0
+
+    @property
+    def rows(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def _map(self, rows: int):
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        # The file only grows in place, a smaller matrix replaces it (see replace)
+        with open(self.path, "ab") as file:
+            if rows * self.dim * 4 > file.tell():
+                file.truncate(rows * self.dim * 4)
+        self.inode = os.stat(self.path).st_ino
+        if rows:
+            self.matrix = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def refresh(self):
+        """Maps the file again when another process (e.g. `python -m corpus rebuild`) replaced it."""
+        if os.path.exists(self.path) and os.stat(self.path).st_ino != self.inode:
+            self.matrix = None
+            self._map(self._file_rows())
+
+    def set(self, row: int, vector: np.ndarray):
+        self.refresh()
+        if row >= self.rows:
+            # Grow in steps so that a new document does not remap the file every time
+            self._map(max(row + 1, self.rows * 2, 1024))
+        self.matrix[row] = vector
+
+    def similarities(self, rows: list[int], vector: np.ndarray) -> np.ndarray:
+        self.refresh()
+        rows = [row for row in rows if row < self.rows]
+        return self.matrix[rows] @ vector if rows else np.zeros(0, dtype=np.float32)
+
+    def replace(self, matrix: np.ndarray):
+        """Replaces all the vectors, used when the rows are renumbered. The new matrix is written to another
+        file and renamed over the old one, so a process that still maps the old file is not truncated under it."""
+        temporary = f"{self.path}.tmp"
+        matrix.astype(np.float32).tofile(temporary)
+        os.replace(temporary, self.path)
+        self.matrix = None
+        self._map(matrix.shape[0])
+
+    def flush(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+
+
+class Corpus:
+    """Persistent store of the search results with a BM25 inverted index.
+
+    A result is stored once per URL and keeps the time it was fetched, so `lookup` only answers from
+    results that are fresh enough. All the methods are blocking, the tools call them in a worker thread.
+    """
+
+    def __init__(self, db_path: str = CORPUS_DB, vectors_path: str | None = CORPUS_VECTORS):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL,
+                content TEXT NOT NULL,
+                query TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                length INTEGER NOT NULL,
+                row INTEGER NOT NULL
+            )"""
+        )
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id INTEGER NOT NULL,
+                frequency INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_fetched ON documents (fetched_at)")
+        self.conn.commit()
+        self.vectors = VectorStore(vectors_path) if vectors_path else None
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, query: str, results: list[dict]) -> int:
+        """Stores the results of a search, returns the number of new or changed documents."""
+        now = time.time()
+        added = 0
+        with self.lock:
+            for result in results:
+                url, title, content = result.get("url"), result.get("title") or "", result.get("content") or ""
+                if not url or not content:
+                    continue
+                row = self.conn.execute("SELECT id, content, row FROM documents WHERE url = ?", (url,)).fetchone()
+                if row and row[1] == content:
+                    continue  # e.g. the same results served again by the search cache
+                document_terms = terms(f"{title} {content}")
+                if row:
+                    doc_id, vector_row = row[0], row[2]
+                    self.conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+                    self.conn.execute(
+                        "UPDATE documents SET title = ?, content = ?, query = ?, fetched_at = ?, length = ? WHERE id = ?",
+                        (title, content, query, now, len(document_terms), doc_id),
+                    )
+                else:
+                    vector_row = self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM documents").fetchone()[0]
+                    doc_id = self.conn.execute(
+                        "INSERT INTO documents (url, title, content, query, fetched_at, length, row) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (url, title, content, query, now, len(document_terms), vector_row),
+                    ).lastrowid
+                self.conn.executemany(
+                    "INSERT INTO postings (term, doc_id, frequency) VALUES (?, ?, ?)",
+                    [(term, doc_id, frequency) for term, frequency in Counter(document_terms).items()],
+                )
+                if self.vectors:
+                    self.vectors.set(vector_row, embed(f"{title} {content}"))
+                added += 1
+            self.conn.commit()
+        return added
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        """The documents that best match the query: BM25 candidates, re-ranked by the dense vectors if enabled."""
+        query_terms = sorted(set(terms(query)))
+        if not query_terms:
+            return []
+        with self.lock:
+            count, average_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM documents").fetchone()
+            if not count:
+                return []
+            placeholders = ",".join("?" * len(query_terms))
+            postings = self.conn.execute(
+                f"SELECT term, doc_id, frequency FROM postings WHERE term IN ({placeholders})", query_terms
+            ).fetchall()
+            document_frequency = Counter(term for term, _, _ in postings)
+            lengths = dict(self.conn.execute(
+                f"SELECT id, length FROM documents WHERE id IN (SELECT doc_id FROM postings WHERE term IN ({placeholders}))",
+                query_terms,
+            ).fetchall())
+
+            scores, matched = Counter(), Counter()
+            for term, doc_id, frequency in postings:
+                idf = math.log(1 + (count - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_id] / (average_length or 1))
+                scores[doc_id] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                matched[doc_id] += 1
+            candidates = [doc_id for doc_id, _ in scores.most_common(limit * 4)]
+            if not candidates:
+                return []
+            rows = self.conn.execute(
+                f"SELECT id, url, title, content, fetched_at, row FROM documents WHERE id IN ({','.join('?' * len(candidates))})",
+                candidates,
+            ).fetchall()
+
+            best = max(scores[doc_id] for doc_id in candidates)
+            ranked = {doc_id: scores[doc_id] / best for doc_id in candidates}
+            if self.vectors:
+                self.vectors.refresh()
+                in_matrix = [row for row in rows if row[5] < self.vectors.rows]
+                similarities = self.vectors.similarities([row[5] for row in in_matrix], embed(query))
+                for row, cosine in zip(in_matrix, similarities):
+                    ranked[row[0]] = (ranked[row[0]] + float(cosine)) / 2
+
+        now = time.time()
+        hits = [
+            {
+                "url": url,
+                "title": title,
+                "content": content,
+                "score": ranked[doc_id],
+                "coverage": matched[doc_id] / len(query_terms),
+                "age": now - fetched_at,
+            }
+            for doc_id, url, title, content, fetched_at, _ in rows
+        ]
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        return hits[:limit]
+
+    def lookup(
+        self,
+        query: str,
+        max_age: float = CORPUS_MAX_AGE,
+        min_coverage: float = CORPUS_MIN_COVERAGE,
+        min_results: int = CORPUS_MIN_RESULTS,
+    ) -> list[dict] | None:
+        """Fresh and relevant results of the query from the corpus, or None when a web search is needed."""
+        hits = [
+            hit for hit in self.search(query, limit=max(5, min_results))
+            if hit["age"] <= max_age and hit["coverage"] >= min_coverage
+        ]
+        if len(hits) < min_results:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return hits
+
+    def compact(self, retention: float = CORPUS_RETENTION, max_documents: int = CORPUS_MAX_DOCUMENTS) -> int:
+        """Drops the documents older than `retention` and the oldest ones above `max_documents`,
+        then rebuilds the index and the vectors so the freed space is reclaimed. Returns the dropped count."""
+        with self.lock:
+            dropped = self.conn.execute("DELETE FROM documents WHERE fetched_at < ?", (time.time() - retention,)).rowcount
+            dropped += self.conn.execute(
+                "DELETE FROM documents WHERE id IN (SELECT id FROM documents ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+                (max_documents,),
+            ).rowcount
+            # In the same transaction, so a search never sees the postings of a dropped document
+            self.conn.execute("DELETE FROM postings WHERE doc_id NOT IN (SELECT id FROM documents)")
+            self.conn.commit()
+        self.rebuild()
+        with self.lock:
+            self.conn.execute("VACUUM")
+        return dropped
+
+    def rebuild(self):
+        """Rebuilds the inverted index and the dense vectors from the stored documents."""
+        with self.lock:
+            documents = self.conn.execute("SELECT id, title, content FROM documents ORDER BY id").fetchall()
+            self.conn.execute("DELETE FROM postings")
+            matrix = np.zeros((len(documents), self.vectors.dim), dtype=np.float32) if self.vectors else None
+            for row, (doc_id, title, content) in enumerate(documents):
+                document_terms = terms(f"{title} {content}")
+                self.conn.execute("UPDATE documents SET length = ?, row = ? WHERE id = ?", (len(document_terms), row, doc_id))
+                self.conn.executemany(
+                    "INSERT INTO postings (term, doc_id, frequency) VALUES (?, ?, ?)",
+                    [(term, doc_id, frequency) for term, frequency in Counter(document_terms).items()],
+                )
+                if self.vectors:
+                    matrix[row] = embed(f"{title} {content}")
+            self.conn.commit()
+            if self.vectors:
+                self.vectors.replace(matrix)
+
+    def stats(self) -> dict:
+        with self.lock:
+            documents, oldest = self.conn.execute("SELECT COUNT(*), MIN(fetched_at) FROM documents").fetchone()
+            terms_count = self.conn.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+        return {
+            "documents": documents,
+            "terms": terms_count,
+            "oldest_age": time.time() - oldest if oldest else 0.0,
+            "vector_rows": self.vectors.rows if self.vectors else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def prometheus_text(self) -> str:
+        """The size and the lookups of the corpus in the Prometheus text exposition format."""
+        stats = self.stats()
+        return exposition_text(
+            metric_lines("deep_research_corpus_lookups_total", "counter", "Searches of the corpus by result.", [
+                ({"result": "hit"}, stats["hits"]),
+                ({"result": "miss"}, stats["misses"]),
+            ])
+            + metric_lines("deep_research_corpus_documents", "gauge", "Documents in the corpus.", stats["documents"])
+            + metric_lines("deep_research_corpus_terms", "gauge", "Distinct terms of the corpus index.", stats["terms"])
+            + metric_lines("deep_research_corpus_oldest_age_seconds", "gauge", "Age of the oldest document of the corpus.", float(stats["oldest_age"]))
+        )
+
+
+@functools.cache
+def get_corpus() -> Corpus | None:
+    """One corpus for the whole process, opened on first use. None when it is disabled."""
+    return Corpus() if CORPUS_DB else None
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    corpus = get_corpus()
+    if corpus is None:
+        sys.exit("The corpus is disabled, set CORPUS_DB")
+    if command == "search":
+        for hit in corpus.search(" ".join(sys.argv[2:])):
+            print(f"{hit['score']:.2f}  coverage {hit['coverage']:.0%}  {hit['age'] / 3600:.1f}h  {hit['title']}  {hit['url']}")
+    elif command == "compact":
+        print(f"dropped {corpus.compact()} documents")
+        print(corpus.stats())
+    elif command == "rebuild":
+        started_at = time.perf_counter()
+        corpus.rebuild()
+        print(f"rebuilt the index in {time.perf_counter() - started_at:.1f}s")
+        print(corpus.stats())
+    else:
+        print(corpus.stats())
@@ -1,70 +1,33 @@
-import os
+import uuid
+import asyncio
 import chainlit as cl 
+from chainlit.server import app
+from fastapi.responses import PlainTextResponse
 from agents import(
     Agent,
-    MaxTurnsExceeded,
-    Runner,
-    AsyncOpenAI ,
-    OpenAIChatCompletionsModel ,
     ModelSettings ,
     RunConfig,
     RunContextWrapper,
-    RunHooks , 
-    SQLiteSession
 )
-from dotenv import load_dotenv, find_dotenv 
+from clients import LazyChatModel
 from research_agents import  requirement_gathering_agent , lead_agent
-from tools import Info ,save_user_memory, search_user_memory
-# Load environment variables
-load_dotenv(find_dotenv())
-# Force Agents SDK to use Chat Completions API to avoid Responses API event types
-
-# It is an API_key of Gemini 
-gemini_api_key = os.environ.get("GEMINI_API_KEY") 
-if not gemini_api_key:
-    raise ValueError("Gemini API key is not set . Please , ensure that it is defined in your env file.")
-
-# Here The api key of OpenAI 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    raise ValueError("OpenAI API key is not set. Please ensure OPENAI_API_KEY is defined in your .env file.")
-
-# Add rate limiting class
-class RateLimiter:
-    def __init__(self, max_requests=1, time_window=60):
-        self.max_requests = max_requests
-        self.time_window = time_window
-        self.requests = []
-    
-    async def wait_if_needed(self):
-        now = time.time()
-        self.requests = [req_time for req_time in self.requests if now - req_time < self.time_window]
-        
-        if len(self.requests) >= self.max_requests:
-            sleep_time = self.time_window - (now - self.requests[0]) + 1
-            print(f"⏳ Rate limit reached. Waiting {sleep_time:.1f} seconds...")
-            await asyncio.sleep(sleep_time)
-            self.requests = []
-        
-        self.requests.append(now)
-
-# Global rate limiter
-rate_limiter = RateLimiter(max_requests=1, time_window=60)
-
-# Step 1: Create a provider 
-provider = AsyncOpenAI(
-    api_key=gemini_api_key,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    timeout=30.0,
-    max_retries=3
-)
-
-# Step 2: Create a model
-model = OpenAIChatCompletionsModel(
-    openai_client=provider,
-    model="gemini-2.5-flash"
-) 
-# Step 3:  Create a RunConfig to pass the session name for tracing
+from research_pipeline import run_research
+from hooks import DeepResearchHooks
+from instrumentation import metrics
+from tools import Info ,save_user_memory, search_user_memory, sanitize_user_id
+from memory_service import memory_service
+from rate_limiter import RateLimitedModel, limiters, limiters_prometheus_text
+from session_store import get_session_store
+from history_summary import SummarizingSession
+from plan_cache import plan_cache
+from search_cache import get_search_cache
+from prefetch import prefetch_metrics
+from corpus import get_corpus
+from router import route, log_decision, RESEARCH, SIMPLE, COORDINATOR, CONTINUATION
+# Step 1: Create a model on the shared Gemini client, which is created on the first call.
+# Every call goes through the shared Gemini rate limiter
+model = RateLimitedModel(LazyChatModel("gemini-2.5-flash"), limiters["gemini"])
+# Step 2:  Create a RunConfig to pass the session name for tracing
 run_config = RunConfig(workflow_name="Deep Research Session")
 
 def deep_research_instructions(Wrapper: RunContextWrapper, agent: Agent) -> str:
@@ -87,53 +50,60 @@ agent : Agent = Agent(
         )
 )
 
-class DeepResearchHooks(RunHooks):
-    def __init__(self):
-        self.active_agents = []
-        self.handoffs = 0
-        self.tool_usage = {}
-    
-    async def on_agent_start(self, context : RunContextWrapper, agent:Agent):
-        self.active_agents.append(agent.name)
-        print(f"🌅 SYSTEM: {agent.name} is now working")
-        print(f"   Active agents so far: {self.active_agents}")
-    
-    async def on_llm_start(self,context:RunContextWrapper, agent:Agent, system_prompt, input_items):
-        print(f"📞 SYSTEM: {agent.name} is thinking with all his capabilities ...")
-    
-    async def on_llm_end(self, context:RunContextWrapper, agent:Agent, response):
-        print(f"🧠✨ SYSTEM: {agent.name} finished thinking")
-    
-    async def on_tool_start(self, context:RunContextWrapper, agent:Agent, tool):
-        tool_name = tool.name
-        if tool_name not in self.tool_usage:
-            self.tool_usage[tool_name] = 0
-        self.tool_usage[tool_name] += 1
-        print(f"🔨 SYSTEM: {tool_name} used {self.tool_usage[tool_name]} times")
-    
-    async def on_tool_end(self, context:RunContextWrapper, agent:Agent, tool, result):
-        print(f"✅🔨 SYSTEM: {agent.name} finished using {tool.name}")
-    
-    async def on_handoff(self, context:RunContextWrapper, from_agent, to_agent):
-        self.handoffs += 1
-        print(f"🏃‍♂️➡️🏃‍♀️ HANDOFF #{self.handoffs}: {from_agent.name} → {to_agent.name}")
-    
-    async def on_agent_end(self, context:RunContextWrapper, agent:Agent, output):
-        print(f"✅ SYSTEM: {agent.name} completed their work")
-        print(f"📊 STATS: {len(self.active_agents)} agents used, {self.handoffs} handoffs")
-    
+# Latency and token metrics of all the runs of this process, the caches and the rate limiters, in the Prometheus text format
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.prometheus_text()
+        + plan_cache.prometheus_text()
+        + prefetch_metrics.prometheus_text()
+        + get_search_cache().prometheus_text()
+        + memory_service.prometheus_text()
+        + limiters_prometheus_text()
+        + (get_corpus().prometheus_text() if get_corpus() else "")
+    )
+
+# chainlit serves its frontend with a catch-all route, the metrics route has to come before it
+app.router.routes.insert(0, app.router.routes.pop())
+
 @cl.on_chat_start
 async def handle_message():
     """Handle the chat start event."""
-    # Create a new session for each chat, identified by the user's session ID.
-    # This ensures that conversation history is isolated between chats.
-    session = SQLiteSession("abdullah1","Database.bd")
+    # Create a new session for each chat, identified by the user and the chat thread.
+    # This ensures that conversation history is isolated between users and chats.
+    user = cl.user_session.get("user")
+    thread_id = cl.context.session.thread_id
+    session = get_session_store().session(f"{user.identifier}:{thread_id}" if user else thread_id)
+    # Only the recent turns are replayed verbatim, the older ones are summarized
+    session = SummarizingSession(session)
     cl.user_session.set("session", session)
+    # Removes the old history of all the sessions in the background
+    get_session_store().start_pruning()
 
     # Send a welcome message when the chat starts
     await cl.Message(content="Hello! I am DeepSearch Agent , your personal assistant. How can I help you today?").send()
 
 
+async def stream_event_to_message(event, msg: cl.Message) -> None:
+    """Stream tokens and tool/handoff progress of the research into the chainlit message."""
+    if event.type == "raw_response_event":
+        # Only the text deltas are shown, the rest are function call argument deltas etc.
+        if getattr(event.data, "type", "") == "response.output_text.delta":
+            await msg.stream_token(event.data.delta)
+    elif event.type == "agent_updated_stream_event":
+        await msg.stream_token(f"\n\n> 🏃 **{event.new_agent.name}** is working...\n\n")
+    elif event.type == "run_item_stream_event":
+        if event.name == "tool_called":
+            tool_name = getattr(event.item.raw_item, "name", "tool")
+            await msg.stream_token(f"\n> 🔨 Using `{tool_name}`...\n\n")
+        elif event.name == "handoff_occured":
+            await msg.stream_token(
+                f"\n> 🏃‍♂️➡️🏃‍♀️ {event.item.source_agent.name} → {event.item.target_agent.name}\n\n"
+            )
+    elif event.type == "progress_event":
+        await msg.stream_token(f"\n> 🔎 {event.text}\n\n")
+
+
 @cl.on_message
 async def main(message: cl.Message):
     """Process incoming messages and generate responses."""
@@ -154,41 +124,86 @@ async def main(message: cl.Message):
         await cl.Message(content="Your session history has been cleared.").send()
         return
 
-    msg = cl.Message(content="Thinking...")
+    # A failed research can be continued from its last checkpoint
+    failed_run = cl.user_session.get("failed_run")
+    resume = message.content.lower().strip() in ["resume", "resume research"]
+    if resume and not failed_run:
+        await cl.Message(content="There is no failed research to resume.").send()
+        return
+
+    msg = cl.Message(content="")
     await msg.send()
 
+    # "/fresh <message>" asks for a new plan instead of a cached one
+    fresh_plan = message.content.startswith("/fresh")
+    if fresh_plan:
+        message.content = message.content.removeprefix("/fresh").strip()
+
+    if resume:
+        # Same run id, message and starting agent, the finished stages are loaded from the checkpoints
+        run_id, content, starting_agent, decision = failed_run["run_id"], failed_run["input"], failed_run["agent"], None
+    else:
+        run_id, content = uuid.uuid4().hex, message.content
+        # Pick the starting agent locally when the router is confident, otherwise the coordinator decides
+        decision = route(content, previous_agent=cl.user_session.get("last_agent"))
+        starting_agent = {RESEARCH: requirement_gathering_agent, SIMPLE: lead_agent}.get(decision.target, agent)
+        print(f"🧭 SYSTEM: {starting_agent.name} chosen by the router ({decision.reason}, confidence {decision.confidence:.2f})")
+    coordinator_choice = None
+
+    # give the data of the user to the agent
+    user_Info1 = Info(name="nafay", interests=["AI", "Web development", "Agentic AI"], fresh_plan=fresh_plan, run_id=run_id)
+
+    async def on_event(event):
+        # The first handoff of the coordinator is its routing choice, it labels the router log
+        nonlocal coordinator_choice
+        if (decision and decision.target == COORDINATOR and coordinator_choice is None
+                and event.type == "run_item_stream_event" and event.name == "handoff_occured"):
+            coordinator_choice = RESEARCH if event.item.target_agent is requirement_gathering_agent else SIMPLE
+        await stream_event_to_message(event, msg)
+
+    # Keep a handle on this task so the research can be cancelled when the user leaves the chat.
+    # When the user presses stop, chainlit cancels the task itself.
+    cl.user_session.set("task", asyncio.current_task())
     try:
-        # give the data of the user to the agent
-        user_Info1 = Info(name="nafay", interests=["AI", "Web development", "Agentic AI"])
-
-        result = Runner.run_sync(
-            starting_agent=agent,
-            input=message.content,  
+        # The runs are streamed, the agents run in background tasks and the event loop stays
+        # free for the other chats while this one is being researched.
+        result = await run_research(
+            starting_agent=starting_agent,
+            input=content,
             context=user_Info1,
             run_config=run_config,
-            max_turns=50,  
-            hooks=DeepResearchHooks(),
+            hooks=DeepResearchHooks(run_id),
             session=session,
+            max_turns=50,
+            on_event=on_event,
+            resume=resume,
+            # An answer to the questions of the Requirement Gathering Agent is not a search query, it is not prefetched
+            prefetch=not (decision and decision.reason == CONTINUATION),
         )
-        
-        # # Stream the response token by token and surface tool outputs
-        # async for event in result.stream_events():
-        #     if event.type == "raw_response_event" and hasattr(event.data, 'delta'):
-        #         token = event.data.delta
-        #         await msg.stream_token(token)
-        #     elif event.type == "run_item_stream_event":
-        #         item = getattr(event, "item", None)
-        #         if item and getattr(item, "type", "") == "tool_call_output_item":
-        #             output_text = str(getattr(item, "output", ""))
-        #             if output_text:
-        #                 await msg.stream_token(output_text)
-
-        await cl.Message(content=result.final_output).send()
-
-
-    except MaxTurnsExceeded as e:
-        await cl.Message(content="Max Turns Exceeded. Please ask your Question again.").send()
-  
+        cl.user_session.set("failed_run", None)
+        # A reply of the Requirement Gathering Agent is answered by the user in the next message
+        cl.user_session.set("last_agent", result.last_agent.name)
+
+        # Replace the streamed progress with the clean final answer
+        msg.content = str(result.final_output)
+
     except Exception as e:
-        await cl.Message(content=f"Error:{str(e)}").send()
+        cl.user_session.set("failed_run", {"run_id": run_id, "input": content, "agent": starting_agent})
+        await cl.Message(content=f"Error:{str(e)}\nType 'resume' to continue the research from where it stopped.").send()
         print(f"Error:{str(e)}")
+
+    finally:
+        await msg.update()
+        cl.user_session.set("task", None)
+        if decision:
+            log_decision(content, decision, coordinator_choice)
+        # Save the memories that were queued during this run
+        await memory_service.flush(sanitize_user_id(user_Info1.name))
+
+
+@cl.on_chat_end
+async def handle_chat_end():
+    """Cancel the running research when the client disconnects."""
+    task = cl.user_session.get("task")
+    if task and not task.done():
+        task.cancel()
@@ -0,0 +1,165 @@
+import asyncio
+from collections import OrderedDict
+from agents import Runner
+from agents.memory import Session, SessionABC
+from research_agents import summary_agent
+from compaction import estimate_tokens
+from settings import getenv
+
+HISTORY_TOKEN_BUDGET = int(getenv("HISTORY_TOKEN_BUDGET", 4000))  # tokens of history replayed per run
+HISTORY_SUMMARY_SHARE = 0.25  # part of the budget reserved for the running summary
+TOOL_OUTPUT_MAX_CHARS = int(getenv("HISTORY_TOOL_OUTPUT_MAX_CHARS", 600))
+HISTORY_SUMMARY_WAIT = float(getenv("HISTORY_SUMMARY_WAIT", 10))  # seconds a run waits for a summary still being refreshed
+
+HISTORY_MAX_SESSIONS = int(getenv("HISTORY_MAX_SESSIONS", 1000))  # running summaries kept, the least recently used are dropped
+
+# session id -> (last summarized item, summary), the running summaries of the recently used sessions.
+# A dropped summary is rebuilt in the background the next time its session is used.
+summaries: OrderedDict[str, tuple[dict, str]] = OrderedDict()
+# session id -> background refresh of its summary, removed when it finishes
+refreshes: dict[str, asyncio.Task] = {}
+
+
+def remember_summary(session_id: str, last_item: dict, summary: str):
+    summaries[session_id] = (last_item, summary)
+    summaries.move_to_end(session_id)
+    while len(summaries) > HISTORY_MAX_SESSIONS:
+        summaries.popitem(last=False)
+
+
+def shorten_tool_output(item: dict) -> dict:
+    """Replaces a large tool output (e.g. a search dump) of the history with a short reference."""
+    if item.get("type") != "function_call_output":
+        return item
+    output = str(item.get("output", ""))
+    if len(output) <= TOOL_OUTPUT_MAX_CHARS:
+        return item
+    reference = (f"{output[:200]}... [{len(output)} characters of tool output omitted from the history "
+                 f"(call {item.get('call_id')}), search again if the details are needed]")
+    return {**item, "output": reference}
+
+
+def item_text(item: dict) -> str:
+    """Readable text of a history item, used as the input of the summarizer."""
+    if item.get("type") == "function_call":
+        return f"tool call {item.get('name')}({item.get('arguments')})"
+    if item.get("type") == "function_call_output":
+        return f"tool output: {item.get('output')}"
+    content = item.get("content", "")
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return f"{item.get('role', item.get('type', 'item'))}: {content}"
+
+
+async def summarize_history(previous_summary: str, items: list[dict]) -> str:
+    """Merges the items into the previous summary with the cheap summary agent."""
+    conversation = "\n".join(item_text(item) for item in items)
+    result = await Runner.run(
+        summary_agent,
+        f"Previous summary:\n{previous_summary or '(none)'}\n\nNew part of the conversation:\n{conversation}",
+        max_turns=1,
+    )
+    return str(result.final_output)
+
+
+class SummarizingSession(SessionABC):
+    """Session wrapper that keeps the replayed history within a token budget.
+
+    The most recent turns are given verbatim, the older ones are replaced by a running summary, and large
+    tool outputs are replaced with short references. The wrapped session still stores the full items.
+    The summary is refreshed in the background after new items are added (only the turns that just left
+    the window are summarized), so `get_items` does not wait for the summarizer.
+    """
+
+    def __init__(self, session: Session, token_budget: int = HISTORY_TOKEN_BUDGET, summarizer=summarize_history):
+        self.session = session
+        self.session_id = session.session_id
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+
+    def _split(self, items: list[dict]) -> tuple[list[dict], list[dict]]:
+        """The older items, covered by the summary, and the recent ones given verbatim."""
+        # Keep whole turns (starting at a user message) from the end while they fit in the budget
+        recent_budget = self.token_budget * (1 - HISTORY_SUMMARY_SHARE)
+        cut, used = len(items), 0
+        for index in range(len(items) - 1, -1, -1):
+            used += estimate_tokens(items[index])
+            if used > recent_budget:
+                break
+            if items[index].get("role") == "user":
+                cut = index
+        return items[:cut], items[cut:]
+
+    async def get_items(self, limit: int | None = None) -> list:
+        # The refresh started by the last add_items is usually done by the time the user sends a message
+        refresh = refreshes.get(self.session_id)
+        if refresh and not refresh.done():
+            await asyncio.wait({refresh}, timeout=HISTORY_SUMMARY_WAIT)
+
+        items = [shorten_tool_output(item) for item in await self.session.get_items(limit)]
+        older, recent = self._split(items)
+        if not older:
+            return recent
+
+        last_item, summary = summaries.get(self.session_id, (None, ""))
+        if last_item is not None:
+            summaries.move_to_end(self.session_id)
+        refresh = refreshes.get(self.session_id)
+        if last_item != older[-1] and (refresh is None or refresh.done()):
+            # e.g. a chat of a previous process: the summary is brought up to date for the next run
+            print(f"📝 SYSTEM: the summary of session {self.session_id} is behind the history, refreshing it in the background")
+            self._start_refresh()
+        if not summary:
+            return recent
+        return [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] + recent
+
+    def _start_refresh(self):
+        """Refreshes the summary in a background task, after the refresh already running for the session."""
+        task = asyncio.ensure_future(self._refresh(refreshes.get(self.session_id)))
+        refreshes[self.session_id] = task
+
+        def forget(task: asyncio.Task):
+            if refreshes.get(self.session_id) is task:
+                del refreshes[self.session_id]
+
+        task.add_done_callback(forget)
+
+    async def _refresh(self, previous: asyncio.Task | None):
+        if previous:
+            await asyncio.wait({previous})
+        try:
+            items = [shorten_tool_output(item) for item in await self.session.get_items()]
+            older, _ = self._split(items)
+            if older:
+                await self._summary(older)
+        except Exception as e:
+            # The runs keep the previous summary, the next refresh covers the missing items
+            print(f"Error while summarizing the history of session {self.session_id}: {e}")
+
+    async def _summary(self, older: list[dict]) -> str:
+        """Returns the running summary covering `older`, summarizing only the items it did not cover yet."""
+        last_item, summary = summaries.get(self.session_id, (None, ""))
+        new_items = older
+        if last_item is not None:
+            for index in range(len(older) - 1, -1, -1):
+                if older[index] == last_item:
+                    new_items = older[index + 1:]
+                    break
+        if new_items:
+            summary = await self.summarizer(summary, new_items)
+            remember_summary(self.session_id, older[-1], summary)
+        return summary
+
+    async def add_items(self, items: list) -> None:
+        await self.session.add_items(items)
+        self._start_refresh()
+
+    async def pop_item(self):
+        return await self.session.pop_item()
+
+    async def clear_session(self) -> None:
+        refresh = refreshes.pop(self.session_id, None)
+        if refresh:
+            refresh.cancel()
+        summaries.pop(self.session_id, None)
+        await self.session.clear_session()
@@ -0,0 +1,90 @@
+import time
+import uuid
+from collections import defaultdict
+from agents import Agent, RunContextWrapper, RunHooks
+from instrumentation import TraceWriter, metrics
+
+
+class DeepResearchHooks(RunHooks):
+    """Prints the progress of a run and records the timing and token usage of every step.
+
+    Durations go to the process-wide `instrumentation.metrics` and every event is written to the
+    trace of the run. The same hooks can be shared by the parallel sub agent runs of a research.
+    """
+
+    def __init__(self, run_id: str | None = None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.trace = TraceWriter(self.run_id)
+        self.active_agents = []
+        self.handoffs = 0
+        self.tool_usage = {}
+        self.input_tokens = 0
+        self.output_tokens = 0
+        # Start times of the running steps, the runs (contexts) are kept apart for the parallel sub agents
+        self.started = defaultdict(list)
+        self.pending_handoffs = {}  # (run, agent name) -> (from agent name, time)
+
+    def _start(self, *key):
+        self.started[key].append(time.monotonic())
+
+    def _end(self, kind: str, name: str, *key, **fields) -> float:
+        starts = self.started.get(key)
+        duration = time.monotonic() - starts.pop(0) if starts else 0.0
+        metrics.observe(kind, name, duration)
+        self.trace.write({"kind": kind, "name": name, "duration": duration, **fields})
+        return duration
+
+    async def on_agent_start(self, context : RunContextWrapper, agent:Agent):
+        self.active_agents.append(agent.name)
+        self._start("agent", id(context), agent.name)
+        handoff = self.pending_handoffs.pop((id(context), agent.name), None)
+        if handoff:
+            from_agent, handoff_time = handoff
+            duration = time.monotonic() - handoff_time
+            metrics.observe("handoff", f"{from_agent} -> {agent.name}", duration)
+            self.trace.write({"kind": "handoff", "name": f"{from_agent} -> {agent.name}", "duration": duration})
+        print(f"🌅 SYSTEM: {agent.name} is now working")
+        print(f"   Active agents so far: {self.active_agents}")
+
+    async def on_llm_start(self,context:RunContextWrapper, agent:Agent, system_prompt, input_items):
+        self._start("llm", id(context), agent.name)
+        print(f"📞 SYSTEM: {agent.name} is thinking with all his capabilities ...")
+
+    async def on_llm_end(self, context:RunContextWrapper, agent:Agent, response):
+        usage = response.usage
+        self.input_tokens += usage.input_tokens
+        self.output_tokens += usage.output_tokens
+        metrics.add_tokens(agent.name, usage.input_tokens, usage.output_tokens)
+        duration = self._end(
+            "llm", agent.name, "llm", id(context), agent.name,
+            agent=agent.name, input_tokens=usage.input_tokens, output_tokens=usage.output_tokens,
+        )
+        print(f"🧠✨ SYSTEM: {agent.name} finished thinking in {duration:.1f}s ({usage.input_tokens} in / {usage.output_tokens} out tokens)")
+
+    async def on_tool_start(self, context:RunContextWrapper, agent:Agent, tool):
+        tool_name = tool.name
+        if tool_name not in self.tool_usage:
+            self.tool_usage[tool_name] = 0
+        self.tool_usage[tool_name] += 1
+        self._start("tool", id(context), agent.name, tool_name)
+        print(f"🔨 SYSTEM: {tool_name} used {self.tool_usage[tool_name]} times")
+
+    async def on_tool_end(self, context:RunContextWrapper, agent:Agent, tool, result):
+        duration = self._end(
+            "tool", tool.name, "tool", id(context), agent.name, tool.name,
+            agent=agent.name, output_chars=len(str(result)),
+        )
+        print(f"✅🔨 SYSTEM: {agent.name} finished using {tool.name} in {duration:.1f}s")
+
+    async def on_handoff(self, context:RunContextWrapper, from_agent, to_agent):
+        self.handoffs += 1
+        self._end("agent", from_agent.name, "agent", id(context), from_agent.name)
+        # The handoff latency is measured until the next agent starts
+        self.pending_handoffs[(id(context), to_agent.name)] = (from_agent.name, time.monotonic())
+        print(f"🏃‍♂️➡️🏃‍♀️ HANDOFF #{self.handoffs}: {from_agent.name} → {to_agent.name}")
+
+    async def on_agent_end(self, context:RunContextWrapper, agent:Agent, output):
+        self._end("agent", agent.name, "agent", id(context), agent.name)
+        print(f"✅ SYSTEM: {agent.name} completed their work")
+        print(f"📊 STATS: {len(self.active_agents)} agents used, {self.handoffs} handoffs, "
+              f"{self.input_tokens + self.output_tokens} tokens")
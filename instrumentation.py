@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from settings import getenv
+
+# Folder of the per run traces (one JSON lines file per run), an empty value disables them
+TRACE_DIR = getenv("TRACE_DIR", "traces")
+# Number of recent samples kept per agent / tool to compute the percentiles
+MAX_SAMPLES = int(getenv("METRICS_MAX_SAMPLES", 5000))
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class MetricsAggregator:
+    """Process-wide latency and token metrics of every run, per kind (llm, tool, handoff, agent) and name."""
+
+    def __init__(self, max_samples: int = MAX_SAMPLES):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=max_samples))  # (kind, name) -> durations
+        self.counts = defaultdict(int)
+        self.sums = defaultdict(float)
+        self.tokens = defaultdict(int)  # (agent, "input" | "output") -> tokens
+
+    def observe(self, kind: str, name: str, duration: float):
+        with self.lock:
+            self.samples[(kind, name)].append(duration)
+            self.counts[(kind, name)] += 1
+            self.sums[(kind, name)] += duration
+
+    def add_tokens(self, agent: str, input_tokens: int, output_tokens: int):
+        with self.lock:
+            self.tokens[(agent, "input")] += input_tokens
+            self.tokens[(agent, "output")] += output_tokens
+
+    def summary(self) -> dict:
+        """p50 / p95 / p99 of the durations in seconds, per kind and name."""
+        with self.lock:
+            result = {}
+            for (kind, name), samples in self.samples.items():
+                values = sorted(samples)
+                result[f"{kind}:{name}"] = {
+                    "count": self.counts[(kind, name)],
+                    "p50": percentile(values, 0.50),
+                    "p95": percentile(values, 0.95),
+                    "p99": percentile(values, 0.99),
+                }
+            return result
+
+    def prometheus_text(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        name = "deep_research_duration_seconds"
+        lines = metric_lines(name, "summary", "Duration of LLM calls, tool calls, handoffs and agent turns.", [])
+        with self.lock:
+            for (kind, tool), samples in sorted(self.samples.items()):
+                values = sorted(samples)
+                labels = {"kind": kind, "name": tool}
+                for q in (0.5, 0.95, 0.99):
+                    lines.append(sample_line(name, {**labels, "quantile": q}, percentile(values, q)))
+                lines.append(sample_line(f"{name}_sum", labels, self.sums[(kind, tool)]))
+                lines.append(sample_line(f"{name}_count", labels, self.counts[(kind, tool)]))
+            lines += metric_lines("deep_research_tokens_total", "counter", "Tokens used by the LLM calls of each agent.", [
+                ({"agent": agent, "direction": direction}, tokens) for (agent, direction), tokens in sorted(self.tokens.items())
+            ])
+        return exposition_text(lines)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def sample_line(name: str, labels: dict, value) -> str:
+    """One sample of a metric in the Prometheus text exposition format, a float is written with 6 decimals."""
+    text = f"{value:.6f}" if isinstance(value, float) else str(value)
+    if not labels:
+        return f"{name} {text}"
+    label_text = ",".join(f'{key}="{_escape(str(label))}"' for key, label in labels.items())
+    return f"{name}{{{label_text}}} {text}"
+
+
+def metric_lines(name: str, kind: str, help: str, samples) -> list[str]:
+    """The HELP, TYPE and sample lines of a metric. `samples` is one value without labels,
+    or a list of (labels, value) pairs."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples if isinstance(samples, list) else [({}, samples)]:
+        lines.append(sample_line(name, labels, value))
+    return lines
+
+
+def exposition_text(lines: list[str]) -> str:
+    return "\n".join(lines) + "\n"
+
+
+class TraceWriter:
+    """Writes the events of one run as JSON lines in `<trace_dir>/<run_id>.jsonl`."""
+
+    def __init__(self, run_id: str, trace_dir: str | None = TRACE_DIR):
+        self.run_id = run_id
+        self.path = os.path.join(trace_dir, f"{run_id}.jsonl") if trace_dir else None
+        self.lock = threading.Lock()
+        if self.path:
+            os.makedirs(trace_dir, exist_ok=True)
+
+    def write(self, event: dict):
+        if not self.path:
+            return
+        line = json.dumps({"run_id": self.run_id, "time": time.time(), **event}, default=str)
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+# Shared by every run of the process
+metrics = MetricsAggregator()
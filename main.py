@@ -1,42 +1,28 @@
-import os
+import uuid
 import asyncio
-from agents import Agent, Runner, AsyncOpenAI , OpenAIChatCompletionsModel , RunConfig , function_tool , ModelSettings , RunContextWrapper, set_default_openai_api , SQLiteSession
-from dotenv import load_dotenv, find_dotenv 
-from tavily import AsyncTavilyClient
+from agents import Agent, RunConfig , function_tool , ModelSettings , RunContextWrapper, set_default_openai_api
+from clients import clients, LazyChatModel
 from research_agents import requirement_gathering_agent
+from web_search import chainlit_step
+from search_cache import get_search_cache
+from research_pipeline import run_research
+from hooks import DeepResearchHooks
+from session_store import get_session_store
+from history_summary import SummarizingSession
+from memory_service import memory_service
+from router import route, CONTINUATION
+from rate_limiter import RateLimitedModel, limiters, with_retries
 from dataclasses import dataclass 
-# Load environment variables
-load_dotenv(find_dotenv())
 # Force Agents SDK to use Chat Completions API to avoid Responses API event types
 set_default_openai_api("chat_completions")
 
-# It is an API_key of Gemini 
-gemini_api_key = os.getenv("GEMINI_API_KEY")  
-if not gemini_api_key:
-    raise ValueError("Gemini API key is not set . Please , ensure that it is defined in your env file.")
-# It is an API key of Tavily
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-if not tavily_api_key:
-    raise ValueError("Tavily API key is not set. Please ensure TAVILY_API_KEY is defined in your .env file.")
-tavily_client = AsyncTavilyClient(api_key=tavily_api_key)
-# It is used to show the display message in the chat 
-# Step 1: Create a provider 
-provider = AsyncOpenAI(
-    api_key=gemini_api_key,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-)
-    # Step 2: Create a model
-model = OpenAIChatCompletionsModel(
-    openai_client=provider,
-    model="gemini-2.5-flash"
-) 
+# Step 1 and 2: Create a model on the shared Gemini client of the registry, every call goes through the shared Gemini rate limiter
+model = RateLimitedModel(LazyChatModel("gemini-2.5-flash"), limiters["gemini"])
     # Step 3: Define config at run level
 run_config = RunConfig(
     model=model,
     workflow_name="Deep Research Agent in CLI"
 )
-#   step 4 : Define Session for history 
-session = SQLiteSession("User_Bushra","Database.bd")
 def deep_research_instructions(Wrapper: RunContextWrapper, agent: Agent) -> str:
     return f"""You are {agent.name}, an advanced AI research coordinator.
 Your task is to receive the user's research query and  hand it off to the 'Requirement Gathering Agent' to begin the research process. If the Query is simple , you can directly hand it off to the 'Lead Agent' for immediate action.
@@ -48,12 +34,16 @@ class Info:
     father_name : str
     mother_name : str
     sister_name : str
+    run_id : str | None = None
     
 @function_tool 
-@cl.step(type="Web Search Tool")
+@chainlit_step(type="Web Search Tool")
 async def web_search(query: str):
     """Search the web using Tavily."""
-    response = await tavily_client.search(query)
+    # Served from the cache when the same (normalized) query was searched before
+    response = await get_search_cache().get_or_fetch(
+        query, lambda: with_retries(lambda: clients.get("tavily").search(query), limiters["tavily"])
+    )
 
     formatted_results = []
     
@@ -71,7 +61,7 @@ async def web_search(query: str):
     return all_results
 
 @function_tool
-@cl.step(type="Get Info Tool")
+@chainlit_step(type="Get Info Tool")
 async def get_info(Wrapper: RunContextWrapper[Info]) -> str:
     """Return the user's profile information from the run context."""
     return (
@@ -88,7 +78,6 @@ agent = Agent(
     model_settings=ModelSettings(temperature=1.9),
     handoffs = [requirement_gathering_agent]
 )
-chats = []    
 
 async def main():
     user_data = Info(
@@ -97,18 +86,38 @@ async def main():
         mother_name="Bushra",
         sister_name="Hamna"
     )
+    #   step 4 : Define Session for history, one per user
+    # Only the recent turns are replayed verbatim, the older ones are summarized
+    session = SummarizingSession(get_session_store().session(f"cli:{user_data.name}"))
 
 
+    failed_run = None
+    last_agent = None
     while True:
         user_input = input("Enter Your Prompt ...")
         if user_input.lower() in ["exit","quit"]:
             break
-        user_message = {"role":"user","content":f"{user_input}"}
-        chats.append(user_message)
-        result = await Runner.run(agent, chats, run_config=run_config,context = user_data , max_turns=30,session = session)
-        ai_message = {"role":"assistant","content":result.final_output}
-        chats.append(ai_message)
-        print(result.final_output)    
+        # "resume" continues the last failed research from its checkpoints
+        resume = user_input.lower().strip() == "resume" and failed_run is not None
+        if resume:
+            user_data.run_id, user_input = failed_run
+        else:
+            user_data.run_id = uuid.uuid4().hex
+        # An answer to the questions of the Requirement Gathering Agent is not a search query, it is not prefetched
+        prefetch = route(user_input, previous_agent=last_agent).reason != CONTINUATION
+        try:
+            # The session replays the history, so only the new message is given
+            result = await run_research(agent, user_input, run_config=run_config,context = user_data , max_turns=30,session = session, hooks=DeepResearchHooks(user_data.run_id), resume=resume, prefetch=prefetch)
+            last_agent = result.last_agent.name
+            print(result.final_output)
+            failed_run = None
+        except Exception as e:
+            failed_run = (user_data.run_id, user_input)
+            print(f"Error: {e}\nType 'resume' to continue the research from where it stopped.")
+        # Save the memories that were queued during this run
+        await memory_service.flush()    
+    # Close the connection pools of the clients
+    await clients.aclose()
  
         
 asyncio.run(main())  
\ No newline at end of file
@@ -0,0 +1,149 @@
+import re
+import time
+import asyncio
+from collections import defaultdict
+from clients import clients
+from rate_limiter import limiters, with_retries, LOW
+from instrumentation import metric_lines, exposition_text
+from settings import getenv
+
+MEMORY_CACHE_TTL = float(getenv("MEMORY_CACHE_TTL", 300))  # seconds a search result is reused
+MEMORY_FLUSH_INTERVAL = float(getenv("MEMORY_FLUSH_INTERVAL", 5))  # seconds before queued memories are saved
+MEMORY_BATCH_SIZE = int(getenv("MEMORY_BATCH_SIZE", 10))  # queued memories that trigger an immediate save
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+class LocalMemoryBackend:
+    """In-process stand-in for the mem0 client, used when MEM0_API_KEY is not set and for testing."""
+
+    def __init__(self):
+        self.memories = defaultdict(list)
+
+    def search(self, query: str, user_id: str, top_k: int = 10):
+        query_words = set(_normalize(query).split())
+        scored = []
+        for memory in self.memories[user_id]:
+            words = set(_normalize(memory).split())
+            score = len(query_words & words) / len(query_words | words) if words else 0.0
+            scored.append({"memory": memory, "score": score})
+        scored.sort(key=lambda item: item["score"], reverse=True)
+        return scored[:top_k]
+
+    def add(self, messages: list[dict], user_id: str):
+        for message in messages:
+            self.memories[user_id].append(message["content"])
+        return {"results": [{"memory": message["content"], "event": "ADD"} for message in messages]}
+
+
+class MemoryService:
+    """Async layer over a mem0 like client (`search` / `add`).
+
+    The blocking client calls run in a worker thread, search results are cached per user until the
+    user saves something, and saved memories are queued and sent in batches (write-behind).
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        cache_ttl: float = MEMORY_CACHE_TTL,
+        flush_interval: float = MEMORY_FLUSH_INTERVAL,
+        batch_size: int = MEMORY_BATCH_SIZE,
+    ):
+        self._backend = backend
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cache = defaultdict(dict)  # user_id -> {normalized query: (expires_at, result)}
+        self.pending = defaultdict(list)  # user_id -> queued messages
+        self.flush_tasks: dict[str, asyncio.Task] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.flushes = 0
+
+    @property
+    def backend(self):
+        """The given backend, otherwise the shared mem0 client that is created on first use."""
+        return self._backend or clients.get("mem0")
+
+    async def search(self, user_id: str, query: str, top_k: int = 10) -> dict:
+        """The memories of the user for the query, always as {"results": [...], "pending": [...]}."""
+        key = _normalize(query)
+        entry = self.cache[user_id].get(key)
+        if entry and entry[0] > time.time():
+            self.cache_hits += 1
+            result = entry[1]
+        else:
+            self.cache_misses += 1
+            result = await with_retries(
+                lambda: asyncio.to_thread(self.backend.search, query=query, user_id=user_id, top_k=top_k),
+                limiters["mem0"],
+            )
+            self.cache[user_id][key] = (time.time() + self.cache_ttl, result)
+        # Some mem0 versions wrap the results in a dict, the tool output has one shape either way
+        if isinstance(result, dict):
+            result = result.get("results", [])
+        # Memories that are still in the queue are returned as well, so a save is visible right away
+        return {"results": result, "pending": [message["content"] for message in self.pending.get(user_id, [])]}
+
+    async def save(self, user_id: str, content: str):
+        self.pending[user_id].append({"role": "user", "content": content})
+        self.cache.pop(user_id, None)
+        if len(self.pending[user_id]) >= self.batch_size:
+            await self.flush(user_id)
+        elif user_id not in self.flush_tasks:
+            self.flush_tasks[user_id] = asyncio.create_task(self._flush_later(user_id))
+        return {"status": "queued", "memory": content}
+
+    async def _flush_later(self, user_id: str):
+        await asyncio.sleep(self.flush_interval)
+        self.flush_tasks.pop(user_id, None)
+        await self.flush(user_id)
+
+    async def flush(self, user_id: str | None = None):
+        """Saves the queued memories of one user, or of every user when no user is given."""
+        user_ids = [user_id] if user_id else list(self.pending)
+        for user_id in user_ids:
+            task = self.flush_tasks.pop(user_id, None)
+            if task and task is not asyncio.current_task():
+                task.cancel()
+            messages = self.pending.pop(user_id, None)
+            if not messages:
+                continue
+            try:
+                await with_retries(
+                    lambda: asyncio.to_thread(self.backend.add, messages, user_id=user_id),
+                    limiters["mem0"],
+                    LOW,
+                )
+                self.flushes += 1
+            except Exception as e:
+                # Put them back, they are retried on the next flush
+                self.pending[user_id] = messages + self.pending.get(user_id, [])
+                print(f"Error while saving memories of {user_id}: {e}")
+            self.cache.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "flushes": self.flushes,
+            "pending": sum(len(messages) for messages in self.pending.values()),
+        }
+
+    def prometheus_text(self) -> str:
+        """The cache and the queued saves of the memories in the Prometheus text exposition format."""
+        stats = self.stats()
+        return exposition_text(
+            metric_lines("deep_research_memory_cache_lookups_total", "counter", "Memory searches by cache result.", [
+                ({"result": "hit"}, stats["cache_hits"]),
+                ({"result": "miss"}, stats["cache_misses"]),
+            ])
+            + metric_lines("deep_research_memory_flushes_total", "counter", "Batches of queued memories saved to mem0.", stats["flushes"])
+            + metric_lines("deep_research_memory_pending", "gauge", "Memories queued and not saved yet.", stats["pending"])
+        )
+
+
+memory_service = MemoryService()
@@ -0,0 +1,174 @@
+import re
+import time
+import hashlib
+from collections import OrderedDict, Counter
+import numpy as np
+from instrumentation import metric_lines, exposition_text
+from settings import getenv
+
+PLAN_CACHE_TTL = float(getenv("PLAN_CACHE_TTL", 24 * 60 * 60))  # seconds a plan is reused
+PLAN_CACHE_SIZE = int(getenv("PLAN_CACHE_SIZE", 512))  # plans kept in memory
+PLAN_CACHE_SIMILARITY = float(getenv("PLAN_CACHE_SIMILARITY", 0.9))  # cosine needed to reuse a similar plan
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "for", "to", "with", "about", "is", "are", "be",
+    "what", "how", "me", "my", "i", "we", "please", "want", "need", "know", "tell", "give",
+}
+
+
+def canonicalize(requirements) -> str:
+    """Canonical text of the gathered requirements: lower case, without punctuation and stopwords,
+    and with the focus areas and constraints sorted so that their order does not matter."""
+
+    def clean(text: str) -> str:
+        words = re.sub(r"[^\w\s]", " ", text.lower()).split()
+        return " ".join(word for word in words if word not in STOPWORDS)
+
+    if isinstance(requirements, str):
+        return clean(requirements)
+    focus_areas = sorted(filter(None, (clean(area) for area in requirements.focus_areas)))
+    constraints = sorted(filter(None, (clean(constraint) for constraint in requirements.constraints)))
+    return f"topic: {clean(requirements.topic)} | focus: {'; '.join(focus_areas)} | constraints: {'; '.join(constraints)}"
+
+
+def split_canonical(canonical: str) -> tuple[str, str]:
+    """The topic and focus areas of a canonical text, compared by similarity, and its constraints, which must match exactly."""
+    subject, _, constraints = canonical.partition(" | constraints: ")
+    return subject, constraints
+
+
+def terms(text: str) -> list[str]:
+    """Words and word bigrams of a canonical text."""
+    words = re.findall(r"\w+", text)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class PlanCache:
+    """Cache of the Planning Agent's plans keyed on the canonical requirements.
+
+    A lookup tries the exact hash first and then the most similar cached requirements, by the cosine
+    of the TF-IDF vectors of their topic and focus areas. Only requirements with the same constraints
+    (timeframe, region, format...) are compared, a plan for 2023 is not reused for 2024. The vectors
+    are computed with NumPy and only rebuilt when the cache changes.
+    """
+
+    def __init__(self, max_size: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL, similarity: float = PLAN_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.entries = OrderedDict()  # hash -> (expires_at, canonical text, plan)
+        self.matrix = None  # (keys, constraints, vocabulary, idf, normalized TF-IDF rows), None when out of date
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(canonical: str) -> str:
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, requirements, fresh: bool = False):
+        """Returns the cached plan of equivalent requirements, or None. `fresh` bypasses the cache."""
+        if fresh:
+            self.bypassed += 1
+            return None
+        self._expire()
+        canonical = canonicalize(requirements)
+        key = self.key(canonical)
+        if key in self.entries:
+            self.exact_hits += 1
+            return self._use(key)
+
+        match = self._most_similar(canonical)
+        if match is not None:
+            self.similar_hits += 1
+            return self._use(match)
+        self.misses += 1
+        return None
+
+    def put(self, requirements, plan):
+        canonical = canonicalize(requirements)
+        key = self.key(canonical)
+        self.entries[key] = (time.time() + self.ttl, canonical, plan)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.matrix = None
+
+    def _use(self, key: str):
+        self.entries.move_to_end(key)
+        return self.entries[key][2]
+
+    def _expire(self):
+        now = time.time()
+        expired = [key for key, (expires_at, _, _) in self.entries.items() if expires_at < now]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self.matrix = None
+
+    def _build_matrix(self):
+        keys = list(self.entries)
+        subjects, constraints = zip(*(split_canonical(self.entries[key][1]) for key in keys))
+        documents = [Counter(terms(subject)) for subject in subjects]
+        vocabulary = {term: index for index, term in enumerate(sorted(set().union(*documents)))}
+        counts = np.zeros((len(keys), len(vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for term, count in document.items():
+                counts[row, vocabulary[term]] = count
+        idf = np.log((1 + len(keys)) / (1 + (counts > 0).sum(axis=0))) + 1
+        rows = counts * idf
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True) + 1e-12
+        self.matrix = (keys, np.array(constraints, dtype=object), vocabulary, idf, rows)
+
+    def _most_similar(self, canonical: str) -> str | None:
+        """Key of the cached requirements most similar to `canonical` if it is above the threshold."""
+        if not self.entries:
+            return None
+        if self.matrix is None:
+            self._build_matrix()
+        keys, constraints, vocabulary, idf, rows = self.matrix
+        subject, wanted_constraints = split_canonical(canonical)
+        vector = np.zeros(len(vocabulary), dtype=np.float32)
+        unseen = 0.0  # weight of the terms no cached requirements have, they only lower the cosine
+        for term, count in Counter(terms(subject)).items():
+            if term in vocabulary:
+                vector[vocabulary[term]] = count
+            else:
+                unseen += (count * (np.log(1 + len(keys)) + 1)) ** 2
+        vector *= idf
+        norm = np.sqrt(np.dot(vector, vector) + unseen)
+        if norm == 0:
+            return None
+        scores = np.where(constraints == wanted_constraints, rows @ (vector / norm), -1.0)
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity else None
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+        }
+
+    def prometheus_text(self) -> str:
+        """The lookups of the cache in the Prometheus text exposition format."""
+        stats = self.stats()
+        return exposition_text(
+            metric_lines("deep_research_plan_cache_lookups_total", "counter", "Lookups of the plan cache by result.", [
+                ({"result": result}, stats[result]) for result in ("exact_hits", "similar_hits", "misses", "bypassed")
+            ])
+            + metric_lines("deep_research_plan_cache_hit_rate", "gauge", "Share of the lookups answered from the cache.", stats["hit_rate"])
+            + metric_lines("deep_research_plan_cache_entries", "gauge", "Plans in the cache.", stats["entries"])
+        )
+
+
+# One cache for the whole process, shared by all the chats
+plan_cache = PlanCache()
@@ -0,0 +1,187 @@
+"""Speculative search prefetch: the searches a research will likely need start when the message arrives.
+
+The Requirement Gathering and Planning Agents take several LLM round trips before the first search, so
+candidate queries are derived locally from the message (the message itself and its keywords) and searched
+in the background. The search tools of the run are served from these results when their query matches
+or overlaps a prefetched one. The prefetch of a run is capped, charged to the search budget of the run,
+cancelled when the run ends, and reports its hit rate and the share of wasted requests.
+"""
+import re
+import asyncio
+import contextvars
+from budget import allow_searches, refund_searches
+from compaction import tokenize
+from plan_cache import STOPWORDS
+from search_cache import normalize_query
+from instrumentation import metric_lines, exposition_text
+from settings import getenv
+
+PREFETCH_MAX_QUERIES = int(getenv("PREFETCH_MAX_QUERIES", 4))  # searches started per run, 0 disables the prefetch
+PREFETCH_MIN_OVERLAP = float(getenv("PREFETCH_MIN_OVERLAP", 0.7))  # keyword Jaccard to serve an overlapping query
+PREFETCH_MIN_KEYWORDS = 3  # shorter messages (greetings, answers to a question) are not prefetched
+QUERY_KEYWORDS = 8
+MAX_QUERY_CHARS = 400  # longest query Tavily accepts
+
+# Words of a request that do not help a search query
+QUERY_STOPWORDS = STOPWORDS | {
+    "at", "by", "from", "as", "it", "its", "their", "this", "that", "these", "those", "do", "does", "can",
+    "should", "which", "why", "vs", "versus", "research", "analyze", "explain", "find", "write", "report",
+}
+
+# The clauses of a message (lists, comparisons) are often researched separately
+CLAUSE_SPLIT = re.compile(r"[,;:?!.\n]|\band\b|\bvs\b|\bversus\b", re.IGNORECASE)
+
+
+def keywords(text: str) -> list[str]:
+    """The content words of the text in order, without repeats."""
+    return list(dict.fromkeys(word for word in tokenize(text) if word not in QUERY_STOPWORDS and len(word) > 1))
+
+
+def candidate_queries(message: str, max_queries: int = PREFETCH_MAX_QUERIES) -> list[str]:
+    """The queries the research of the message will likely run: the message, its keywords and the keywords of its clauses."""
+    words = keywords(message)
+    if len(words) < PREFETCH_MIN_KEYWORDS or max_queries <= 0:
+        return []
+    candidates = [" ".join(message.split())[:MAX_QUERY_CHARS], " ".join(words[:QUERY_KEYWORDS])]
+    for clause in CLAUSE_SPLIT.split(message):
+        clause_words = keywords(clause)
+        if len(clause_words) >= 2:
+            candidates.append(" ".join(clause_words[:QUERY_KEYWORDS]))
+
+    queries, seen = [], set()
+    for query in candidates:
+        key = frozenset(keywords(query))
+        if key not in seen:
+            seen.add(key)
+            queries.append(query)
+    return queries[:max_queries]
+
+
+class Prefetcher:
+    """The prefetched searches of one run. `fetch(query)` is awaited in a background task for each query
+    and returns its list of results."""
+
+    def __init__(self, fetch, max_queries: int = PREFETCH_MAX_QUERIES, min_overlap: float = PREFETCH_MIN_OVERLAP):
+        self.fetch = fetch
+        self.max_queries = max_queries
+        self.min_overlap = min_overlap
+        self.tasks: dict[str, asyncio.Task] = {}  # normalized query -> search
+        self.keywords: dict[str, set[str]] = {}
+        self.used: set[str] = set()
+        self.lookups = 0
+        self.hits = 0
+        self.cancelled = 0
+
+    def start(self, message: str) -> list[str]:
+        """Starts the searches of the candidate queries of the message, up to the cap and the search budget of the run."""
+        queries = candidate_queries(message, self.max_queries - len(self.tasks))
+        queries = [query for query in queries if normalize_query(query) not in self.tasks]
+        queries = queries[:allow_searches(len(queries))] if queries else []
+        for query in queries:
+            key = normalize_query(query)
+            self.tasks[key] = asyncio.ensure_future(self.fetch(query))
+            self.keywords[key] = set(keywords(query))
+        if queries:
+            print(f"🚀 SYSTEM: prefetching {len(queries)} searches: {queries}")
+        return queries
+
+    def match(self, query: str) -> str | None:
+        """The prefetched query with the same normalized text, or the one whose keywords overlap most if enough."""
+        key = normalize_query(query)
+        if key in self.tasks:
+            return key
+        words = set(keywords(query))
+        best, best_overlap = None, 0.0
+        for key, prefetched in self.keywords.items():
+            union = words | prefetched
+            overlap = len(words & prefetched) / len(union) if union else 0.0
+            if overlap > best_overlap:
+                best, best_overlap = key, overlap
+        return best if best_overlap >= self.min_overlap else None
+
+    async def lookup(self, query: str) -> list[dict] | None:
+        """The prefetched results for the query, waiting for the search if it is still running. None on a miss."""
+        self.lookups += 1
+        key = self.match(query)
+        if key is None or self.tasks[key].cancelled():
+            return None
+        try:
+            # shield it, so a cancelled tool call does not cancel the search for the other calls
+            results = await asyncio.shield(self.tasks[key])
+        except Exception:
+            # A failed prefetch is a miss, the tool searches again itself
+            return None
+        self.hits += 1
+        if key not in self.used:
+            # The tool charged this search as well, only the prefetched searches that are never used stay charged
+            refund_searches(1)
+        self.used.add(key)
+        return results
+
+    def cancel(self) -> dict:
+        """Cancels the searches that are still running and returns the stats of the run."""
+        for task in self.tasks.values():
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+            elif not task.cancelled():
+                task.exception()  # retrieved, so a failed prefetch is not logged as never retrieved
+        stats = self.stats()
+        prefetch_metrics.record(stats)
+        return stats
+
+    def stats(self) -> dict:
+        launched = len(self.tasks)
+        wasted = launched - len(self.used)
+        return {
+            "launched": launched,
+            "used": len(self.used),
+            "wasted": wasted,
+            "cancelled": self.cancelled,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "wasted_rate": wasted / launched if launched else 0.0,
+        }
+
+
+class PrefetchMetrics:
+    """Totals of the prefetch of all the runs of the process."""
+
+    def __init__(self):
+        self.totals = {"runs": 0, "launched": 0, "used": 0, "wasted": 0, "cancelled": 0, "lookups": 0, "hits": 0}
+
+    def record(self, stats: dict):
+        self.totals["runs"] += 1
+        for name in self.totals.keys() - {"runs"}:
+            self.totals[name] += stats[name]
+
+    def stats(self) -> dict:
+        totals = self.totals
+        return {
+            **totals,
+            "hit_rate": totals["hits"] / totals["lookups"] if totals["lookups"] else 0.0,
+            "wasted_rate": totals["wasted"] / totals["launched"] if totals["launched"] else 0.0,
+        }
+
+    def prometheus_text(self) -> str:
+        """The prefetched searches in the Prometheus text exposition format."""
+        stats = self.stats()
+        return exposition_text(
+            metric_lines("deep_research_prefetch_searches_total", "counter", "Prefetched searches by outcome.", [
+                ({"outcome": outcome}, stats[outcome]) for outcome in ("used", "wasted")
+            ])
+            + metric_lines("deep_research_prefetch_lookups_total", "counter", "Searches of the tools checked against the prefetched ones.", [
+                ({"result": "hit"}, stats["hits"]),
+                ({"result": "miss"}, stats["lookups"] - stats["hits"]),
+            ])
+            + metric_lines("deep_research_prefetch_hit_rate", "gauge", "Share of the searches of the tools served from the prefetch.", stats["hit_rate"])
+            + metric_lines("deep_research_prefetch_wasted_rate", "gauge", "Share of the prefetched searches that were never used.", stats["wasted_rate"])
+        )
+
+
+# Totals of the whole process, exported with the other metrics
+prefetch_metrics = PrefetchMetrics()
+
+# Prefetcher of the research run in progress, set by research_pipeline.run_research
+run_prefetcher: contextvars.ContextVar[Prefetcher | None] = contextvars.ContextVar("run_prefetcher", default=None)
@@ -0,0 +1,225 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from collections import deque
+from agents.models.interface import Model
+from compaction import estimate_tokens
+from instrumentation import metric_lines, exposition_text
+from settings import getenv
+
+# Priorities of the requests, a lower number is served first
+HIGH = 0  # Lead Agent synthesis
+NORMAL = 1  # the agents of the handoff chain and their tools
+LOW = 2  # speculative work like the reflect / citation sub agents and background saves
+
+MAX_ATTEMPTS = int(getenv("RATE_LIMIT_MAX_ATTEMPTS", 5))
+BASE_DELAY = float(getenv("RATE_LIMIT_BASE_DELAY", 1.0))  # seconds
+MAX_DELAY = float(getenv("RATE_LIMIT_MAX_DELAY", 30.0))  # seconds
+
+# Names of the exceptions of openai, httpx and tavily that are worth a retry
+RETRYABLE_ERRORS = {
+    "RateLimitError",
+    "APIConnectionError",
+    "APITimeoutError",
+    "InternalServerError",
+    "UsageLimitExceededError",
+    "TimeoutError",
+    "ConnectError",
+    "ReadTimeout",
+}
+
+
+class TokenBucketLimiter:
+    """Async token bucket limiter for one backend, with a requests per minute and a tokens per minute bucket.
+
+    Waiting requests are served by priority and then in arrival order.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float | None = None, burst_seconds: float = 10.0):
+        self.name = name
+        self.request_rate = rpm / 60
+        self.request_capacity = max(1.0, self.request_rate * burst_seconds)
+        self.token_rate = tpm / 60 if tpm else None
+        self.token_capacity = max(1.0, self.token_rate * burst_seconds) if tpm else None
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity or 0.0
+        self.updated_at = time.monotonic()
+        self.waiters = []  # heap of (priority, sequence, future, tokens)
+        self.sequence = itertools.count()
+        self.dispatcher: asyncio.Task | None = None
+        # Metrics
+        self.acquired = 0
+        self.retries = 0
+        self.delays = deque(maxlen=1000)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        if self.token_rate:
+            self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    def _wait_time(self, tokens: float) -> float:
+        """Seconds until a request of `tokens` tokens fits in both buckets."""
+        wait = 0.0
+        if self.requests < 1:
+            wait = (1 - self.requests) / self.request_rate
+        if self.token_rate:
+            # A request bigger than the bucket only waits for a full bucket, otherwise it never fits
+            needed = min(tokens, self.token_capacity)
+            if self.tokens < needed:
+                wait = max(wait, (needed - self.tokens) / self.token_rate)
+        return wait
+
+    async def acquire(self, tokens: float = 0, priority: int = NORMAL):
+        """Waits until the request can be sent."""
+        started_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future, tokens))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        self.acquired += 1
+        self.delays.append(time.monotonic() - started_at)
+
+    async def _dispatch(self):
+        while self.waiters:
+            priority, _, future, tokens = self.waiters[0]
+            if future.done():  # the caller was cancelled
+                heapq.heappop(self.waiters)
+                continue
+            self._refill()
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self.waiters)
+            self.requests -= 1
+            if self.token_rate:
+                self.tokens -= tokens
+            future.set_result(None)
+
+    def record_usage(self, tokens: float):
+        """Corrects the token bucket once the real usage of a request is known (can be negative)."""
+        if self.token_rate:
+            self._refill()
+            self.tokens = min(self.token_capacity, self.tokens - tokens)
+
+    def stats(self) -> dict:
+        delays = sorted(self.delays)
+        return {
+            "backend": self.name,
+            "queued": len(self.waiters),
+            "acquired": self.acquired,
+            "retries": self.retries,
+            "avg_delay": sum(delays) / len(delays) if delays else 0.0,
+            "p95_delay": delays[int(len(delays) * 0.95)] if delays else 0.0,
+            "max_delay": delays[-1] if delays else 0.0,
+        }
+
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate limit (429), server (5xx), timeout and connection errors."""
+    status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code == 429 or status_code >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, (ConnectionError, asyncio.TimeoutError))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter, so the waiting callers do not retry at the same moment."""
+    return min(MAX_DELAY, BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def with_retries(call, limiter: TokenBucketLimiter, priority: int = NORMAL, tokens: float = 0):
+    """Runs `call` (returns an awaitable) through the limiter, retrying the retryable errors."""
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.acquire(tokens, priority)
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                raise
+            limiter.retries += 1
+            delay = backoff_delay(attempt)
+            print(f"⏳ {limiter.name} request failed ({type(e).__name__}), retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+
+def prompt_tokens(system_instructions, input) -> int:
+    """Rough prompt size used to reserve tokens before the request."""
+    return estimate_tokens(system_instructions or "") + estimate_tokens(input)
+
+
+class RateLimitedModel(Model):
+    """Model wrapper that sends every LLM call through a shared limiter with retries."""
+
+    def __init__(self, model: Model, limiter: TokenBucketLimiter, priority: int = NORMAL):
+        self.model = model
+        self.limiter = limiter
+        self.priority = priority
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, **kwargs):
+        tokens = prompt_tokens(system_instructions, input)
+        response = await with_retries(
+            lambda: self.model.get_response(
+                system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, **kwargs
+            ),
+            self.limiter,
+            self.priority,
+            tokens,
+        )
+        self.limiter.record_usage(response.usage.total_tokens - tokens)
+        return response
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, **kwargs):
+        tokens = prompt_tokens(system_instructions, input)
+        for attempt in range(MAX_ATTEMPTS):
+            await self.limiter.acquire(tokens, self.priority)
+            started = False
+            try:
+                async for event in self.model.stream_response(
+                    system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, **kwargs
+                ):
+                    started = True
+                    if getattr(event, "type", "") == "response.completed" and event.response.usage:
+                        self.limiter.record_usage(event.response.usage.total_tokens - tokens)
+                    yield event
+                return
+            except Exception as e:
+                # Once events were streamed to the run it can't be retried anymore
+                if started or attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                    raise
+                self.limiter.retries += 1
+                await asyncio.sleep(backoff_delay(attempt))
+
+
+# One limiter per backend, shared by every agent and every chat of the process
+limiters = {
+    "gemini": TokenBucketLimiter(
+        "gemini", rpm=float(getenv("GEMINI_RPM", 60)), tpm=float(getenv("GEMINI_TPM", 1_000_000))
+    ),
+    "tavily": TokenBucketLimiter("tavily", rpm=float(getenv("TAVILY_RPM", 100))),
+    "mem0": TokenBucketLimiter("mem0", rpm=float(getenv("MEM0_RPM", 60))),
+}
+
+
+def limiters_prometheus_text() -> str:
+    """The requests and the queueing delay of the limiters in the Prometheus text exposition format."""
+    stats = [limiter.stats() for limiter in limiters.values()]
+    lines = []
+    for name, kind, help, key in [
+        ("deep_research_rate_limit_acquired_total", "counter", "Requests let through by the rate limiter.", "acquired"),
+        ("deep_research_rate_limit_retries_total", "counter", "Requests retried after a retryable error.", "retries"),
+        ("deep_research_rate_limit_queued", "gauge", "Requests waiting in the rate limiter.", "queued"),
+    ]:
+        lines += metric_lines(name, kind, help, [({"backend": backend["backend"]}, backend[key]) for backend in stats])
+    lines += metric_lines("deep_research_rate_limit_delay_seconds", "gauge", "Queueing delay of the last 1000 requests of the rate limiter.", [
+        ({"backend": backend["backend"], "statistic": statistic}, float(backend[f"{statistic}_delay"]))
+        for backend in stats
+        for statistic in ("avg", "p95", "max")
+    ])
+    return exposition_text(lines)
@@ -1,40 +1,50 @@
-from agents import Agent , AsyncOpenAI, OpenAIChatCompletionsModel, function_tool , RunContextWrapper , ModelSettings
+from clients import LazyChatModel
+from agents import Agent , function_tool , RunContextWrapper , ModelSettings, handoff
 from agents.tool_context import ToolContext 
-import os 
-from dotenv import load_dotenv, find_dotenv
 from openai.types import Reasoning
+from pydantic import BaseModel
 from tools import Info , get_info ,save_user_memory , search_user_memory
-from web_search import web_search 
-
-_:bool = load_dotenv(find_dotenv())
-#here the API keys 
-gemini_api_key = os.environ.get("GEMINI_API_KEY")
-if not gemini_api_key:
-    raise ValueError("Gemini API key is not set . Please , ensure that it is defined in your env file.")
-
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    raise ValueError("OpenAI API key is not set. Please ensure OPENAI_API_KEY is defined in your .env file.")
-
-# Step 1: Create a provider 
-provider = AsyncOpenAI(
-    api_key=gemini_api_key,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    max_retries=3,
-    timeout=30.0
+from web_search import web_search, web_search_many
+from rate_limiter import RateLimitedModel, limiters, HIGH, LOW
+from budget import DegradableModel, optional_work_enabled
+
+# Step 1: Create the models, they share the Gemini client of the registry which is created on the first call.
+# Every call goes through the shared Gemini rate limiter
+model = RateLimitedModel(LazyChatModel("gemini-2.5-flash"), limiters["gemini"])
+# The reflect and citation agents are optional work, they wait behind the other calls
+low_priority_model = RateLimitedModel(model.model, limiters["gemini"], priority=LOW)
+# The synthesis of the Lead Agent is served first, with the flash model once half of the run budget is spent
+lead_model = DegradableModel(
+    RateLimitedModel(LazyChatModel("gemini-2.5-pro"), limiters["gemini"], priority=HIGH),
+    RateLimitedModel(model.model, limiters["gemini"], priority=HIGH),
 )
-# Step 2: Create a model
-model = OpenAIChatCompletionsModel(
-    openai_client=provider,
-    model="gemini-2.5-flash"
-) 
+# Cheap model for background work like summarizing the old chat history
+summary_model = RateLimitedModel(LazyChatModel("gemini-2.5-flash-lite"), limiters["gemini"], priority=LOW)
+
+# The typed plan produced by the Planning Agent, executed by research_executor.execute_plan
+class Subtask(BaseModel):
+    title: str
+    objective: str
+    queries: list[str]
+
+class Requirements(BaseModel):
+    """Requirements handed to the Planning Agent, also the key of the plan cache."""
+    topic: str
+    focus_areas: list[str]
+    constraints: list[str]  # e.g. timeframe, region, depth, format
+
+class ResearchPlan(BaseModel):
+    objectives: list[str]
+    subtasks: list[Subtask]
+    methodology: str
+    deliverables: list[str]
 
 # Here the Dynamic Instructions are as follows :
 def dynamic_instructions(Wrapper: RunContextWrapper[Info], agent: Agent) -> str:
     return f"""You are the {agent.name}, an expert researcher responsible for executing a research plan.
     
-You have been given a detailed plan from the Planning Agent . You should follow the plan of planning agent. Your tasks are:
-1. Execute the research plan step-by-step, using the 'web_search' tool with the specified queries.
+If you have been given the findings of the research subtasks, your job is only the synthesis: do not repeat their searches, use the 'web_search' tool only to fill an important gap. Otherwise, you have been given a research query or plan . You should follow the plan of planning agent. Your tasks are:
+1. Execute the research plan by passing all the specified queries together to the 'web_search_many' tool in a single call. Use the 'web_search' tool only for a follow-up query.
 2. Gather all necessary information from the web.
 3. Analyze and synthesize the collected information thoroughly.
 4. Structure your final response with clear sections as requested, such as:
@@ -42,7 +52,7 @@ You have been given a detailed plan from the Planning Agent . You should follow
    - Detailed analysis
    - Supporting evidence
    - Recommendations (if applicable)
-5. ALWAYS cite your sources properly using markdown links.
+5. ALWAYS cite your sources properly using markdown links to the URLs returned by the search tools. The links are checked against the search results, a link to any other URL is removed.
 6. Use search_user_memory tool to get memory about user and use save_user_memory tool to save it . Always search by using tool 'search_user_memory' data about user and save important chats in the 'save_user_memory' tool for better performance. 
 You are the final agent in the chain. Your response will be sent directly to the user. Ensure it is comprehensive, accurate, and well-structured."""
 
@@ -59,7 +69,7 @@ Your tasks are:
 
  
 'You have knowledge about the user by using the 'get_info' tool. Use this tool if the user asks you about their personal information like their name.'
-IMPORTANT: Once the requirements are clear, you MUST hand off to the 'Planning Agent'. Do not attempt to answer the user's query or perform any research yourself. Your only goal is to define the research scope for the next agent."""
+IMPORTANT: Once the requirements are clear, you MUST hand off to the 'Planning Agent' with the topic, the focus areas and the constraints (timeframe, region, depth, format) of the research. Do not attempt to answer the user's query or perform any research yourself. Your only goal is to define the research scope for the next agent."""
 
 def planning_instructions(Wrapper: RunContextWrapper[Info], agent: Agent) -> str:
     return f"""You are the {agent.name}, a strategic research planner. Your SOLE responsibility is to create a detailed research plan based on the provided requirements.
@@ -67,8 +77,8 @@ def planning_instructions(Wrapper: RunContextWrapper[Info], agent: Agent) -> str
 Your tasks are:
 1. Review the requirements gathered by the previous agent.
 2. Break down the research into specific, actionable subtasks.
-3. For each subtask, identify the key search queries that the Lead Agent should use.
-4. Structure your output as a clear, step-by-step research plan.
+3. For each subtask, identify the key search queries (at most 3) that should be used.
+4. Structure your output as a clear, step-by-step research plan. Keep subtasks independent from each other, they are researched in parallel.
 5. Use web search tool for better planning if needed .
 6. Always search by using tool 'search_user_memory' data about user for proper plannng save important chats in the 'save_user_memory' tool for better performance.
 
@@ -78,17 +88,38 @@ Your plan should include:
 3. Methodology
 4. Expected Deliverables
 
-IMPORTANT: After creating the plan, you MUST hand off to the 'Lead Agent' for execution. Do NOT perform the research yourself or provide a final answer to the user. Your only deliverable is the plan itself, which will be passed to the next agent."""
+IMPORTANT: Your output is the structured plan. Every subtask is researched by a separate research agent and the 'Lead Agent' then synthesizes their findings. Do NOT perform the research yourself or provide a final answer to the user. Your only deliverable is the plan itself."""
+
+def subtask_instructions(Wrapper: RunContextWrapper[Info], agent: Agent) -> str:
+    return f"""You are the {agent.name}, you research one subtask of a larger research plan.
+
+1. Run all the given queries together with the 'web_search_many' tool in a single call. Use the 'web_search' tool only for one follow-up query if something important is missing.
+2. Reply with a compact summary (at most 250 words) of the findings that answer the objective of the subtask.
+3. Keep the key facts, numbers and dates, and cite every fact with a markdown link to its source.
+Do not write an introduction or a conclusion, your summary is combined with the other subtasks by the Lead Agent."""
 
 def citation_instructions(Wrapper: RunContextWrapper, agent: Agent) -> str:
-    return f"""You are the {agent.name}, responsible for ensuring all information provided by the Lead Agent is properly cited with markdown links. """
+    return f"""You are the {agent.name}, responsible for ensuring all information provided by the Lead Agent is properly cited with markdown links.
+You are only called when the automatic check of the citations failed. Link every claim to one of the given sources and reply with the corrected answer only."""
 def reflect_instructions(Wrapper: RunContextWrapper, agent: Agent) -> str:
     return f"""You are the {agent.name}, responsible for reflecting on the information provided by the Lead Agent and ensuring it is comprehensive and accurate."""
 
+def summary_instructions(Wrapper: RunContextWrapper, agent: Agent) -> str:
+    return f"""You are the {agent.name}, you keep a running summary of a research conversation.
+Merge the new part of the conversation into the previous summary. Keep the user's goals, preferences, decisions, the key findings and the source links that were given. Drop greetings and repetitions.
+Reply with the updated summary only, in at most 200 words."""
+
+summary_agent: Agent = Agent(
+    name="History Summary Agent",
+    instructions=summary_instructions,
+    model=summary_model,
+    model_settings=ModelSettings(temperature=0.2)
+)
+
 citation_agent : Agent = Agent(
     name="Citation Agent",
     instructions=citation_instructions,
-    model=model,
+    model=low_priority_model,
     tools=[web_search],
     handoff_description="Checking for best Citation"
     )
@@ -96,7 +127,7 @@ citation_agent : Agent = Agent(
 reflect_agent: Agent = Agent(
     name = "Refelct Agent",
     instructions = "You are the Reflect Agent. Your task is to reflect on the information provided by the Lead Agent and ensure it is comprehensive and accurate.",
-    model = model,
+    model = low_priority_model,
     tools = [web_search],  # Using get_info tool for citation and validation
     handoff_description="Reflect Agent that Reflects the data"
 ) 
@@ -105,8 +136,8 @@ reflect_agent: Agent = Agent(
 lead_agent: Agent = Agent(
     name="Lead Agent",
     instructions=dynamic_instructions,
-    tools=[web_search, get_info,save_user_memory,search_user_memory,citation_agent.as_tool(tool_name="citation_tool",tool_description="It Checks the Citation for final response"),reflect_agent.as_tool(tool_name="reflect_data_tool",tool_description="It reflects the final response of the Agent.")],  # Added get_info tool to the final agent
-    model=OpenAIChatCompletionsModel(openai_client=provider,model="gemini-2.5-pro"),
+    tools=[web_search, web_search_many, get_info,save_user_memory,search_user_memory,reflect_agent.as_tool(tool_name="reflect_data_tool",tool_description="It reflects the final response of the Agent.",is_enabled=optional_work_enabled)],  # Added get_info tool to the final agent
+    model=lead_model,
     handoff_description="",
     model_settings=ModelSettings(
         temperature=1.9,  #  higher for creative synthesis
@@ -114,24 +145,39 @@ lead_agent: Agent = Agent(
         reasoning=Reasoning(generate_summary="detailed",summary="detailed")
     )
 )
+# Lightweight agent that researches one subtask of the plan, many of them run at the same time
+subtask_agent: Agent = Agent(
+    name="Subtask Research Agent",
+    instructions=subtask_instructions,
+    model=model,
+    tools=[web_search_many, web_search],
+    model_settings=ModelSettings(
+        temperature=0.3,
+        tool_choice="auto"
+    )
+)
 planning_agent: Agent = Agent(
     name="Planning Agent",
     instructions=planning_instructions,
     model=model,
     tools=[web_search,save_user_memory,search_user_memory],  # For plan validation and initial research
-    handoffs=[lead_agent],  # Chained handoff
+    output_type=ResearchPlan,  # The run ends with the plan, the subtasks are then researched in parallel
     model_settings=ModelSettings( 
         temperature=0.8,
         tool_choice="auto"
     )
 )
 
+def store_requirements(Wrapper: RunContextWrapper[Info], requirements: Requirements):
+    # research_pipeline looks the requirements up in the plan cache before the Planning Agent runs
+    Wrapper.context.requirements = requirements
+
 requirement_gathering_agent: Agent = Agent(
     name="Requirement Gathering Agent",
     instructions=gather_requirements_instructions,
     model=model,
     tools=[web_search,get_info,save_user_memory,search_user_memory],  # Allow web search for requirement validation
-    handoffs=[planning_agent],  # Chained handoff
+    handoffs=[handoff(planning_agent, input_type=Requirements, on_handoff=store_requirements)],  # Chained handoff
     model_settings=ModelSettings(
         temperature=0.7,  # Lower temperature for more focused responses
         tool_choice="auto"
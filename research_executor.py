@@ -0,0 +1,107 @@
+import asyncio
+from dataclasses import dataclass
+from agents import Runner, RunHooks
+from research_agents import ResearchPlan, Subtask, subtask_agent
+from checkpoints import save_stage
+from settings import getenv
+
+SUBTASK_CONCURRENCY = int(getenv("SUBTASK_CONCURRENCY", 4))  # subtasks researched at the same time
+SUBTASK_TIMEOUT = float(getenv("SUBTASK_TIMEOUT", 120))  # seconds for one subtask
+SUBTASK_MAX_TURNS = int(getenv("SUBTASK_MAX_TURNS", 6))
+
+
+@dataclass
+class SubtaskResult:
+    subtask: Subtask
+    summary: str
+    ok: bool
+
+
+def subtask_input(plan: ResearchPlan, subtask: Subtask) -> str:
+    """The small context given to a sub agent: the goal of the research and its own subtask only."""
+    queries = "\n".join(f"- {query}" for query in subtask.queries)
+    return f"""Research objectives: {"; ".join(plan.objectives)}
+
+Subtask: {subtask.title}
+Objective: {subtask.objective}
+Queries:
+{queries}"""
+
+
+async def run_subtask(plan: ResearchPlan, subtask: Subtask, context, hooks: RunHooks | None, semaphore: asyncio.Semaphore, timeout: float) -> SubtaskResult:
+    async with semaphore:
+        try:
+            result = await asyncio.wait_for(
+                Runner.run(
+                    subtask_agent,
+                    subtask_input(plan, subtask),
+                    context=context,
+                    hooks=hooks,
+                    max_turns=SUBTASK_MAX_TURNS,
+                ),
+                timeout,
+            )
+            summary = str(result.final_output)
+            await save_stage("subtask", summary, subtask.title)
+            return SubtaskResult(subtask, summary, True)
+        except asyncio.TimeoutError:
+            print(f"⏰ SYSTEM: subtask '{subtask.title}' timed out after {timeout} seconds")
+            return SubtaskResult(subtask, "This subtask timed out, no findings.", False)
+        except Exception as e:
+            print(f"Error in subtask '{subtask.title}': {e}")
+            return SubtaskResult(subtask, f"This subtask failed: {e}", False)
+
+
+async def execute_plan(
+    plan: ResearchPlan,
+    context,
+    hooks: RunHooks | None = None,
+    max_concurrency: int = SUBTASK_CONCURRENCY,
+    timeout: float = SUBTASK_TIMEOUT,
+    completed: dict[str, str] | None = None,
+) -> list[SubtaskResult]:
+    """Researches every subtask of the plan concurrently, each one with its own sub agent.
+    `completed` maps the titles of the subtasks finished by a previous attempt to their summaries."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    completed = completed or {}
+
+    async def research(subtask: Subtask) -> SubtaskResult:
+        if subtask.title in completed:
+            return SubtaskResult(subtask, completed[subtask.title], True)
+        return await run_subtask(plan, subtask, context, hooks, semaphore, timeout)
+
+    return await asyncio.gather(*(research(subtask) for subtask in plan.subtasks))
+
+
+def synthesis_input(plan: ResearchPlan, results: list[SubtaskResult]) -> str:
+    """The input of the Lead Agent: the plan and the compact findings of the subtasks."""
+    findings = "\n\n".join(f"### {result.subtask.title}\n{result.summary}" for result in results)
+    return f"""Synthesize the final research report from the findings of the research subtasks below.
+
+Research objectives: {"; ".join(plan.objectives)}
+Methodology: {plan.methodology}
+Expected deliverables: {"; ".join(plan.deliverables)}
+
+## Findings of the subtasks
+
+{findings}"""
+
+
+def forced_synthesis_input(question: str, results: list[SubtaskResult], sources: dict, max_sources: int = 10) -> str:
+    """The input of the Lead Agent when the budget of the run is spent: everything gathered so far."""
+    findings = "\n\n".join(f"### {result.subtask.title}\n{result.summary}" for result in results if result.ok)
+    excerpts = "\n\n".join(
+        f"### {source.get('title', '')}\n{source.get('content', '')[:600]}\n##### [Source]({source['url']})"
+        for source in list(sources.values())[:max_sources]
+    )
+    return f"""The research budget is spent and no more searches can be run. Write the best answer you can from the information gathered so far, and say briefly what could not be covered.
+
+Question: {question}
+
+## Findings of the subtasks
+
+{findings or "None."}
+
+## Search results
+
+{excerpts or "None."}"""
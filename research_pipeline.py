@@ -0,0 +1,225 @@
+import asyncio
+import dataclasses
+from dataclasses import dataclass
+from agents import Agent, Runner, RunConfig, RunHooks, ModelSettings, MaxTurnsExceeded
+from research_agents import ResearchPlan, Requirements, lead_agent, planning_agent, citation_agent
+from research_executor import execute_plan, synthesis_input, forced_synthesis_input, SUBTASK_TIMEOUT
+from plan_cache import plan_cache
+from checkpoints import current_run_id, get_checkpoints, save_stage
+from prefetch import Prefetcher, run_prefetcher, PREFETCH_MAX_QUERIES
+from web_search import search_sources
+from citations import run_sources, record_sources, parse_formatted_results, verify_citations, sources_input
+from budget import Budget, BudgetHooks, BudgetExhausted, run_budget, budget_stage, NO_OPTIONAL
+
+
+@dataclass
+class ProgressEvent:
+    """Progress of the pipeline itself, sent to `on_event` together with the stream events of the runs."""
+
+    text: str
+    type: str = "progress_event"
+
+
+async def stream_run(result, on_event=None, context=None):
+    """Consumes the events of a streamed run, passing each one to `on_event` if given.
+
+    When the run hands off to the Planning Agent with requirements that have a cached plan, the run is
+    stopped before the Planning Agent is called and the cached plan is returned, otherwise None.
+    """
+    async for event in result.stream_events():
+        if on_event:
+            await on_event(event)
+        if event.type == "agent_updated_stream_event" and event.new_agent is planning_agent:
+            requirements = getattr(context, "requirements", None)
+            if requirements:
+                await save_stage("requirements", requirements.model_dump())
+            plan = plan_cache.get(requirements, fresh=getattr(context, "fresh_plan", False)) if requirements else None
+            if plan is not None:
+                result.cancel()
+                print(f"📋 SYSTEM: reusing a cached plan for '{requirements.topic}'")
+                return plan
+    return None
+
+
+async def check_citations(result, context, run_config: RunConfig | None = None, hooks: RunHooks | None = None):
+    """Verifies the links of the final answer against the sources the run retrieved and returns the fixed
+    answer. The Citation Agent is only called when the local verification leaves too many claims without a source."""
+    sources = run_sources.get()
+    if result.last_agent is not lead_agent or not sources:
+        return result.final_output
+    text, report = verify_citations(str(result.final_output), sources)
+    if report.failed and budget_stage() < NO_OPTIONAL:
+        print(f"🔗 SYSTEM: {report.uncited}/{report.claims} claims without a source, asking the Citation Agent")
+        try:
+            fixed = await Runner.run(citation_agent, sources_input(text, sources), context=context, run_config=run_config, hooks=hooks)
+            fixed_text, fixed_report = verify_citations(str(fixed.final_output), sources)
+            # The answer of the agent is only kept when it cites more of the claims
+            if fixed_report.claims >= report.claims and fixed_report.uncited < report.uncited:
+                text, report = fixed_text, fixed_report
+        except Exception as e:
+            print(f"Error in the Citation Agent: {e}")
+    print(f"🔗 SYSTEM: citations {report.supported} supported, {report.stripped} stripped, {report.attached} attached, "
+          f"{report.uncited}/{report.claims} claims without a source")
+    return text
+
+
+async def forced_synthesis(question: str, results: list, context, run_config: RunConfig | None = None, hooks: RunHooks | None = None):
+    """The Lead Agent answers from what the run gathered, in one turn and without tools."""
+    run_config = dataclasses.replace(run_config or RunConfig(), model_settings=ModelSettings(tool_choice="none"))
+    return await Runner.run(
+        lead_agent,
+        forced_synthesis_input(question, results, run_sources.get() or {}),
+        context=context,
+        run_config=run_config,
+        hooks=hooks,
+        max_turns=2,
+    )
+
+
+def requirements_input(requirements: Requirements) -> str:
+    """Input of the Planning Agent when a run resumes from its checkpointed requirements."""
+    return f"Create the research plan for these requirements:\n{requirements.model_dump_json(indent=2)}"
+
+
+async def run_research(
+    starting_agent: Agent,
+    input: str,
+    context,
+    run_config: RunConfig | None = None,
+    hooks: RunHooks | None = None,
+    session=None,
+    max_turns: int = 50,
+    on_event=None,
+    resume: bool = False,
+    budget: Budget | None = None,
+    prefetch: bool = True,
+):
+    """Runs the research workflow and returns the result of the last run.
+
+    When the Planning Agent ends the run with a ResearchPlan, its subtasks are researched in
+    parallel by sub agents and the Lead Agent only synthesizes their findings. Plans are cached by
+    their requirements, a cached plan is used without calling the Planning Agent.
+
+    With a run id in the context (`Info.run_id`) every stage is checkpointed, and `resume=True` continues
+    a failed run with the same run id from its last checkpoint instead of starting over.
+
+    The citations of the final answer of the Lead Agent are checked against the search results of the run.
+    While the first agents run, the searches the message will likely need are prefetched (see prefetch.py).
+    `prefetch=False` skips it for a message that is not a question, e.g. an answer to the Requirement
+    Gathering Agent.
+
+    The run degrades as it spends its budget (see budget.py). When the budget is exhausted or the turns
+    run out, the Lead Agent is forced to answer from what was gathered instead of failing.
+    """
+    run_id = getattr(context, "run_id", None)
+    current_run_id.set(run_id)
+    run_sources.set({})
+    budget = budget or Budget()
+    run_budget.set(budget)
+    caller_hooks, hooks = hooks, BudgetHooks(budget, hooks)
+    checkpoint = None
+    checkpoints = get_checkpoints() if run_id else None
+    if resume and checkpoints:
+        checkpoint = await asyncio.to_thread(checkpoints.load, run_id)
+    if checkpoint:
+        print(f"♻️ SYSTEM: resuming run {run_id} ({'plan' if checkpoint.plan else 'requirements' if checkpoint.requirements else 'start'}, "
+              f"{len(checkpoint.subtasks)} finished subtasks, {len(checkpoint.tool_outputs)} search results)")
+        # The searches of the previous attempt are sources of the answer as well
+        for output in checkpoint.tool_outputs:
+            record_sources(parse_formatted_results(str(output)))
+
+    # The requirements of a previous message of the chat do not belong to this run. A resumed run loads
+    # its own, and a run that starts with the Planning Agent was given them by the caller (e.g. batch.py)
+    if not resume and starting_agent is not planning_agent and hasattr(context, "requirements"):
+        context.requirements = None
+
+    # The Lead Agent searches in its first turn, the prefetch only helps the runs that gather requirements first
+    prefetcher = None
+    if prefetch and PREFETCH_MAX_QUERIES and checkpoint is None and starting_agent is not lead_agent:
+        prefetcher = Prefetcher(search_sources)
+        # A run that starts with the Planning Agent is prefetched from its topic, not from the requirements
+        requirements = getattr(context, "requirements", None)
+        prefetcher.start(requirements.topic if requirements and starting_agent is planning_agent else input)
+    run_prefetcher.set(prefetcher)
+
+    # The runs only save the history when they complete, the items they could not save are added at the end
+    user_saved = checkpoint.history_saved if checkpoint else False
+    result = None
+    plan, results = None, []
+    try:
+        try:
+            plan = ResearchPlan.model_validate(checkpoint.plan) if checkpoint and checkpoint.plan else None
+            if plan is None:
+                run_agent, run_input, run_session = starting_agent, input, session
+                if checkpoint and checkpoint.requirements:
+                    context.requirements = Requirements.model_validate(checkpoint.requirements)
+                    run_agent, run_input, run_session = planning_agent, requirements_input(context.requirements), None
+                result = Runner.run_streamed(
+                    run_agent,
+                    run_input,
+                    context=context,
+                    run_config=run_config,
+                    hooks=hooks,
+                    max_turns=max_turns,
+                    session=run_session,
+                )
+                plan = await stream_run(result, on_event, context)
+                user_saved = run_session is not None and plan is None
+                if user_saved:
+                    await save_stage("history", True)
+                if plan is None and isinstance(result.final_output, ResearchPlan):
+                    plan = result.final_output
+                    if getattr(context, "requirements", None):
+                        plan_cache.put(context.requirements, plan)
+                if plan is not None:
+                    await save_stage("plan", plan.model_dump())
+
+            if plan is not None:
+                if on_event:
+                    await on_event(ProgressEvent(f"Researching {len(plan.subtasks)} subtasks in parallel..."))
+                # A subtask does not run past the deadline of the run
+                remaining = budget.remaining_time()
+                timeout = SUBTASK_TIMEOUT if remaining is None else max(1.0, min(SUBTASK_TIMEOUT, remaining))
+                results = await execute_plan(plan, context, hooks, timeout=timeout, completed=checkpoint.subtasks if checkpoint else None)
+
+                # The findings are not saved in the session, only the final answer is
+                result = Runner.run_streamed(
+                    lead_agent,
+                    synthesis_input(plan, results),
+                    context=context,
+                    run_config=run_config,
+                    hooks=hooks,
+                    max_turns=max_turns,
+                )
+                await stream_run(result, on_event)
+
+        except (BudgetExhausted, MaxTurnsExceeded) as e:
+            print(f"💰 SYSTEM: {e}, the Lead Agent answers from what was gathered")
+            if on_event:
+                await on_event(ProgressEvent("The research budget is spent, writing the answer from what was gathered..."))
+            requirements = getattr(context, "requirements", None)
+            question = requirements.model_dump_json() if requirements else input
+            # Past its budget, the forced synthesis is only reported to the hooks of the caller
+            result = await forced_synthesis(question, results, context, run_config, caller_hooks)
+
+        result.final_output = await check_citations(result, context, run_config, hooks)
+        # A run that saved its history saved the unchecked answer, it is kept as is
+        if session and (plan is not None or not user_saved):
+            items = [] if user_saved else [{"role": "user", "content": input}]
+            await session.add_items(items + [{"role": "assistant", "content": str(result.final_output)}])
+        if checkpoints:
+            await asyncio.to_thread(checkpoints.complete, run_id)
+        return result
+
+    except asyncio.CancelledError:
+        # Stop the agents running in the background as well
+        if result is not None:
+            result.cancel()
+        raise
+
+    finally:
+        print(f"💰 SYSTEM: run budget used {budget.summary()}")
+        if prefetcher and prefetcher.tasks:
+            stats = prefetcher.cancel()
+            print(f"🚀 SYSTEM: prefetch used {stats['used']}/{stats['launched']} searches "
+                  f"(hit rate {stats['hit_rate']:.0%}, wasted {stats['wasted_rate']:.0%}, {stats['cancelled']} cancelled)")
@@ -0,0 +1,168 @@
+"""Local routing of a message to its starting agent, without a call to the coordinator LLM.
+
+A few heuristics and a tiny logistic regression over hashed word n-grams decide if a message needs
+the full research workflow (Requirement Gathering Agent) or can go straight to the Lead Agent.
+Below the confidence threshold the DeepSearch coordinator decides as before.
+
+    python -m router router_log.jsonl   # accuracy against the coordinator's choices and latency saved
+"""
+import re
+import sys
+import json
+import math
+import time
+import zlib
+from dataclasses import dataclass, asdict
+from settings import getenv
+
+ROUTER_CONFIDENCE = float(getenv("ROUTER_CONFIDENCE", 0.8))  # below it the coordinator LLM decides
+ROUTER_LOG = getenv("ROUTER_LOG", "router_log.jsonl")  # empty value disables the log
+NUM_FEATURES = 1 << 12
+
+RESEARCH = "requirements"
+SIMPLE = "lead"
+COORDINATOR = "coordinator"
+CONTINUATION = "continuation"  # reason of a message that answers the Requirement Gathering Agent
+
+RESEARCH_WORDS = {
+    "analyze", "analyse", "analysis", "compare", "comparison", "research", "report", "investigate",
+    "comprehensive", "detailed", "in-depth", "depth", "trends", "landscape", "developments", "evaluate",
+    "strategy", "market", "overview", "pros", "cons", "impact", "review", "study",
+}
+
+# Seed examples of the classifier, 1 means the full research workflow
+TRAINING_EXAMPLES = [
+    ("Analyze the latest developments in quantum computing", 1),
+    ("Provide a summary of recent AI regulations in the European Union", 1),
+    ("Compare and contrast different approaches to sustainable energy generation", 1),
+    ("I need a detailed report on the electric vehicle market in Asia", 1),
+    ("Research the impact of remote work on productivity", 1),
+    ("Give me a comprehensive overview of large language model evaluation methods", 1),
+    ("What are the trends in cybersecurity for small businesses this year", 1),
+    ("Investigate the competitive landscape of cloud providers", 1),
+    ("Write an in-depth analysis of the semiconductor supply chain", 1),
+    ("Evaluate the pros and cons of nuclear energy for developing countries", 1),
+    ("Help me research a go to market strategy for a SaaS product", 1),
+    ("Review the scientific studies on intermittent fasting", 1),
+    ("What is the current state of solid state battery research and who are the main players", 1),
+    ("Study the effects of social media on teenagers mental health", 1),
+    ("Create a market analysis for plant based meat in Europe", 1),
+    ("Explain the history and future outlook of fusion power with sources", 1),
+    ("What is the capital of Australia", 0),
+    ("Who is the CEO of Microsoft", 0),
+    ("What time zone is Tokyo in", 0),
+    ("Define photosynthesis", 0),
+    ("How many legs does a spider have", 0),
+    ("When was Python released", 0),
+    ("What is my name", 0),
+    ("Convert 10 miles to kilometers", 0),
+    ("Who won the last football world cup", 0),
+    ("What does API stand for", 0),
+    ("hello", 0),
+    ("thanks", 0),
+    ("What is the weather in Lahore today", 0),
+    ("Translate good morning to French", 0),
+    ("What is the latest version of Python", 0),
+    ("Who wrote Pride and Prejudice", 0),
+]
+
+
+@dataclass
+class RoutingDecision:
+    target: str  # RESEARCH, SIMPLE or COORDINATOR
+    predicted: str  # what the local router would pick, even below the threshold
+    confidence: float
+    reason: str
+    latency_ms: float
+
+
+def features(message: str) -> dict[int, float]:
+    """Hashed word unigrams and bigrams plus a few shape features."""
+    words = re.findall(r"[\w'-]+", message.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode()) % NUM_FEATURES
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+    vector = {index: value / norm for index, value in vector.items()}
+    # Shape features live after the hashed ones
+    vector[NUM_FEATURES] = min(len(words), 40) / 40
+    vector[NUM_FEATURES + 1] = float(any(word in RESEARCH_WORDS for word in words))
+    vector[NUM_FEATURES + 2] = 1.0  # bias
+    return vector
+
+
+class LinearRouter:
+    """Logistic regression over the sparse features, trained on the seed examples at import."""
+
+    def __init__(self, examples=TRAINING_EXAMPLES, epochs: int = 60, learning_rate: float = 0.5, l2: float = 0.01):
+        self.weights = [0.0] * (NUM_FEATURES + 3)
+        data = [(features(text), label) for text, label in examples]
+        for _ in range(epochs):
+            for vector, label in data:
+                error = self.probability(vector) - label
+                for index, value in vector.items():
+                    # The L2 penalty keeps the tiny seed set from making it overconfident
+                    self.weights[index] -= learning_rate * (error * value + l2 * self.weights[index])
+
+    def probability(self, vector: dict[int, float]) -> float:
+        """Probability that the message needs the full research workflow."""
+        score = sum(self.weights[index] * value for index, value in vector.items())
+        return 1 / (1 + math.exp(-max(-30.0, min(30.0, score))))
+
+
+classifier = LinearRouter()
+
+
+def route(message: str, previous_agent: str | None = None, threshold: float = ROUTER_CONFIDENCE) -> RoutingDecision:
+    """Decides the starting agent of a message locally, see the module docstring."""
+    started_at = time.perf_counter()
+    words = re.findall(r"[\w'-]+", message.lower())
+
+    if previous_agent == "Requirement Gathering Agent":
+        # The user is answering the questions of the Requirement Gathering Agent
+        predicted, confidence, reason = RESEARCH, 1.0, CONTINUATION
+    elif len(words) >= 25 or (len(words) >= 8 and sum(word in RESEARCH_WORDS for word in words) >= 2):
+        predicted, confidence, reason = RESEARCH, 0.95, "heuristic"
+    else:
+        probability = classifier.probability(features(message))
+        predicted = RESEARCH if probability >= 0.5 else SIMPLE
+        confidence, reason = max(probability, 1 - probability), "classifier"
+
+    return RoutingDecision(
+        target=predicted if confidence >= threshold else COORDINATOR,
+        predicted=predicted,
+        confidence=confidence,
+        reason=reason,
+        latency_ms=(time.perf_counter() - started_at) * 1000,
+    )
+
+
+def log_decision(message: str, decision: RoutingDecision, coordinator_choice: str | None = None):
+    """Appends the decision to the router log. `coordinator_choice` is the agent the coordinator LLM
+    handed off to when it was asked, it is the label used to measure the accuracy of the router."""
+    if not ROUTER_LOG:
+        return
+    record = {"time": time.time(), "message": message, **asdict(decision), "coordinator_choice": coordinator_choice}
+    with open(ROUTER_LOG, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def evaluate(path: str, coordinator_latency: float = 2.0):
+    """Prints the routing distribution, the accuracy against the coordinator and the latency saved."""
+    with open(path, encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    direct = [record for record in records if record["target"] != COORDINATOR]
+    labeled = [record for record in records if record.get("coordinator_choice")]
+    correct = sum(record["predicted"] == record["coordinator_choice"] for record in labeled)
+    print(f"decisions: {len(records)}, routed locally: {len(direct)}, sent to the coordinator: {len(records) - len(direct)}")
+    if labeled:
+        print(f"accuracy against the coordinator: {correct / len(labeled):.1%} on {len(labeled)} messages")
+    router_ms = sum(record["latency_ms"] for record in records)
+    print(f"estimated latency saved: {len(direct) * coordinator_latency:.0f}s "
+          f"(at {coordinator_latency}s per coordinator call), router time: {router_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    evaluate(sys.argv[1] if len(sys.argv) > 1 else ROUTER_LOG)
@@ -0,0 +1,194 @@
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import functools
+import threading
+from collections import OrderedDict
+from instrumentation import metric_lines, exposition_text
+from settings import getenv
+
+SEARCH_CACHE_TTL = float(getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))  # seconds
+SEARCH_CACHE_SIZE = int(getenv("SEARCH_CACHE_SIZE", 256))  # entries kept in memory
+SEARCH_CACHE_DB = getenv("SEARCH_CACHE_DB", "search_cache.db")  # empty value disables the disk tier
+SEARCH_CACHE_DB_MAX_ENTRIES = int(getenv("SEARCH_CACHE_DB_MAX_ENTRIES", 5000))
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a query so that small differences of case, spaces and punctuation share one key."""
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+class LRUCache:
+    """A bounded in-memory cache, the least recently used entry is evicted first."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.evictions = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value, ttl: float):
+        self.entries[key] = (time.time() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+class SQLiteCache:
+    """A persistent cache tier stored in SQLite with a TTL per entry and a maximum number of entries."""
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS search_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_access ON search_cache (last_access)")
+        self.conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self.conn.execute("DELETE FROM search_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            # Remove the expired entries first and then the least recently used ones above the limit
+            expired = self.conn.execute("DELETE FROM search_cache WHERE expires_at < ?", (now,)).rowcount
+            overflow = self.conn.execute(
+                """DELETE FROM search_cache WHERE key IN (
+                    SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            ).rowcount
+            self.evictions += expired + overflow
+            self.conn.commit()
+
+
+class SearchCache:
+    """Two tier cache (memory LRU + SQLite) in front of the search client.
+
+    Identical queries that are requested at the same time share one request to the search API.
+    """
+
+    def __init__(
+        self,
+        max_memory_entries: int = SEARCH_CACHE_SIZE,
+        ttl: float = SEARCH_CACHE_TTL,
+        db_path: str | None = SEARCH_CACHE_DB,
+        max_disk_entries: int = SEARCH_CACHE_DB_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.memory = LRUCache(max_memory_entries)
+        self.disk = SQLiteCache(db_path, max_disk_entries) if db_path else None
+        self.in_flight: dict[str, asyncio.Task] = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_fetch(self, query: str, fetch):
+        """Returns the cached response of the query, `fetch` is awaited only on a miss."""
+        key = normalize_query(query)
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, fetch))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # shield it, so one cancelled caller does not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, fetch):
+        if self.disk:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value, self.ttl)
+                return value
+
+        self.misses += 1
+        value = await fetch()
+        self.memory.set(key, value, self.ttl)
+        if self.disk:
+            await asyncio.to_thread(self.disk.set, key, value, self.ttl)
+        return value
+
+    def stats(self) -> dict:
+        """Counters of the cache, useful to decide the size and TTL."""
+        lookups = self.memory_hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "memory_evictions": self.memory.evictions,
+            "disk_evictions": self.disk.evictions if self.disk else 0,
+            "memory_entries": len(self.memory.entries),
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+    def prometheus_text(self) -> str:
+        """The lookups of the cache in the Prometheus text exposition format."""
+        stats = self.stats()
+        return exposition_text(
+            metric_lines("deep_research_search_cache_lookups_total", "counter", "Lookups of the search cache by result.", [
+                ({"result": result}, stats[result]) for result in ("memory_hits", "disk_hits", "coalesced", "misses")
+            ])
+            + metric_lines("deep_research_search_cache_evictions_total", "counter", "Entries evicted from the search cache by tier.", [
+                ({"tier": tier}, stats[f"{tier}_evictions"]) for tier in ("memory", "disk")
+            ])
+            + metric_lines("deep_research_search_cache_hit_rate", "gauge", "Share of the lookups answered without a new search.", stats["hit_rate"])
+            + metric_lines("deep_research_search_cache_memory_entries", "gauge", "Results in the memory tier of the search cache.", stats["memory_entries"])
+        )
+
+
+@functools.cache
+def get_search_cache() -> SearchCache:
+    """A single cache shared by every agent and every chat of the process, created on first use."""
+    return SearchCache()
@@ -0,0 +1,168 @@
+import json
+import time
+import queue
+import sqlite3
+import asyncio
+import functools
+from contextlib import contextmanager
+from agents.memory import SessionABC
+from settings import getenv
+
+SESSION_DB = getenv("SESSION_DB", "sessions.db")
+SESSION_POOL_SIZE = int(getenv("SESSION_POOL_SIZE", 4))
+SESSION_MAX_ITEMS = int(getenv("SESSION_MAX_ITEMS", 200))  # items kept per session
+SESSION_MAX_AGE = float(getenv("SESSION_MAX_AGE", 30 * 24 * 60 * 60))  # seconds an item is kept
+SESSION_PRUNE_INTERVAL = float(getenv("SESSION_PRUNE_INTERVAL", 10 * 60))  # seconds between background prunes
+
+
+class SessionStore:
+    """SQLite store for the history of every chat, shared by all the sessions of the process.
+
+    The database runs in WAL mode so reads don't wait for writes, the connections are reused from a
+    small pool, and every session keeps at most `max_items` items that are at most `max_age` seconds old.
+    """
+
+    def __init__(
+        self,
+        db_path: str = SESSION_DB,
+        pool_size: int = SESSION_POOL_SIZE,
+        max_items: int = SESSION_MAX_ITEMS,
+        max_age: float = SESSION_MAX_AGE,
+    ):
+        self.db_path = db_path
+        self.max_items = max_items
+        self.max_age = max_age
+        self.pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.pool.put(conn)
+        with self.connection() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS session_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_session_items_session ON session_items (session_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_session_items_created ON session_items (created_at)")
+        self.prune_task: asyncio.Task | None = None
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.get()
+        try:
+            with conn:  # commits, or rolls back on error
+                yield conn
+        finally:
+            self.pool.put(conn)
+
+    def session(self, session_id: str) -> "PooledSession":
+        return PooledSession(session_id, self)
+
+    # The blocking methods below run in a worker thread
+
+    def _get_items(self, session_id: str, limit: int | None) -> list:
+        limit = min(limit, self.max_items) if limit else self.max_items
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT item FROM session_items WHERE session_id = ? AND created_at >= ? ORDER BY id DESC LIMIT ?",
+                (session_id, time.time() - self.max_age, limit),
+            ).fetchall()
+        items = [json.loads(row[0]) for row in reversed(rows)]
+        # A trimmed history must not start in the middle of a turn, e.g. with a tool output
+        # whose tool call was deleted, so it starts at the first user message
+        for index, item in enumerate(items):
+            if item.get("role") == "user":
+                return items[index:]
+        return items
+
+    def _add_items(self, session_id: str, items: list):
+        now = time.time()
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT INTO session_items (session_id, item, created_at) VALUES (?, ?, ?)",
+                [(session_id, json.dumps(item), now) for item in items],
+            )
+            self._trim(conn, session_id)
+
+    def _trim(self, conn, session_id: str):
+        """Deletes the items of the session above the limit, the oldest first."""
+        conn.execute(
+            """DELETE FROM session_items WHERE session_id = ? AND id <= (
+                SELECT id FROM session_items WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+            )""",
+            (session_id, session_id, self.max_items),
+        )
+
+    def _pop_item(self, session_id: str):
+        with self.connection() as conn:
+            row = conn.execute(
+                "DELETE FROM session_items WHERE id = (SELECT MAX(id) FROM session_items WHERE session_id = ?) RETURNING item",
+                (session_id,),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _clear_session(self, session_id: str):
+        with self.connection() as conn:
+            conn.execute("DELETE FROM session_items WHERE session_id = ?", (session_id,))
+
+    def prune(self) -> int:
+        """Deletes the expired items and trims every session to the maximum number of items."""
+        with self.connection() as conn:
+            deleted = conn.execute(
+                "DELETE FROM session_items WHERE created_at < ?", (time.time() - self.max_age,)
+            ).rowcount
+            session_ids = conn.execute(
+                "SELECT session_id FROM session_items GROUP BY session_id HAVING COUNT(*) > ?", (self.max_items,)
+            ).fetchall()
+            for (session_id,) in session_ids:
+                before = conn.total_changes
+                self._trim(conn, session_id)
+                deleted += conn.total_changes - before
+        return deleted
+
+    def start_pruning(self, interval: float = SESSION_PRUNE_INTERVAL):
+        """Starts the background task that prunes the store every `interval` seconds."""
+        if self.prune_task is None or self.prune_task.done():
+            self.prune_task = asyncio.create_task(self._prune_forever(interval))
+
+    async def _prune_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                deleted = await asyncio.to_thread(self.prune)
+                if deleted:
+                    print(f"🧹 SYSTEM: pruned {deleted} old session items")
+            except Exception as e:
+                print(f"Error while pruning the sessions: {e}")
+
+
+class PooledSession(SessionABC):
+    """Session of one chat, stored in a shared SessionStore."""
+
+    def __init__(self, session_id: str, store: SessionStore):
+        self.session_id = session_id
+        self.store = store
+
+    async def get_items(self, limit: int | None = None) -> list:
+        return await asyncio.to_thread(self.store._get_items, self.session_id, limit)
+
+    async def add_items(self, items: list) -> None:
+        if items:
+            await asyncio.to_thread(self.store._add_items, self.session_id, items)
+
+    async def pop_item(self):
+        return await asyncio.to_thread(self.store._pop_item, self.session_id)
+
+    async def clear_session(self) -> None:
+        await asyncio.to_thread(self.store._clear_session, self.session_id)
+
+
+@functools.cache
+def get_session_store() -> SessionStore:
+    """One store for the whole process, its connections are opened on first use."""
+    return SessionStore()
@@ -0,0 +1,20 @@
+"""Settings of the app, read from the environment and the env file.
+
+Every module reads its settings with `getenv`, which loads the env file on its first call. So the
+values of the env file are seen whichever module is imported first, e.g. `python -m router`.
+"""
+import os
+import functools
+from dotenv import load_dotenv, find_dotenv
+
+
+@functools.cache
+def load_env_file():
+    """Loads the env file, only the first call searches the filesystem for it."""
+    load_dotenv(find_dotenv())
+
+
+def getenv(name: str, default=None):
+    """The value of a setting, from the environment or the env file."""
+    load_env_file()
+    return os.getenv(name, default)
@@ -0,0 +1,45 @@
+"""The tests run the real agents against the local stand-ins of benchmarks/fake_backends.py, no API is called.
+
+The fake servers are started and the env is set before the modules of the app are imported, as they read
+their settings at import.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.fake_backends import FakeChatCompletionsServer, FakeTavilyClient
+from benchmarks.run_benchmark import setup_environment
+
+LLM_LATENCY = 0.2
+SEARCH_LATENCY = 0.2
+
+fake_llm = FakeChatCompletionsServer(latency=LLM_LATENCY).start()
+setup_environment(fake_llm)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fake_backends():
+    from agents import set_tracing_disabled
+    from clients import clients
+    from memory_service import LocalMemoryBackend
+
+    set_tracing_disabled(True)
+    tavily = FakeTavilyClient(latency=SEARCH_LATENCY)
+    clients.override("tavily", tavily)
+    clients.override("mem0", LocalMemoryBackend())
+    yield fake_llm, tavily
+    fake_llm.stop()
+
+
+@pytest.fixture(autouse=True)
+def cold_caches():
+    """Every test starts without cached searches and plans."""
+    from search_cache import get_search_cache
+    from plan_cache import plan_cache
+
+    get_search_cache().memory.entries.clear()
+    plan_cache.entries.clear()
+    plan_cache.matrix = None
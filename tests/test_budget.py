@@ -0,0 +1,64 @@
+import json
+import asyncio
+
+from agents.tool_context import ToolContext
+
+import checkpoints
+from checkpoints import CheckpointStore, current_run_id
+from budget import Budget, run_budget, SEARCH_STOPPED
+from web_search import web_search, web_search_many
+from research_agents import Requirements, lead_agent
+from research_pipeline import run_research
+from tools import Info
+from prefetch import Prefetcher
+
+
+async def call(tool, arguments: dict) -> str:
+    context = ToolContext(context=None, tool_name=tool.name, tool_call_id="call_1")
+    return await tool.on_invoke_tool(context, json.dumps(arguments))
+
+
+def test_stopped_search_is_not_replayed_on_resume(tmp_path, monkeypatch):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    monkeypatch.setattr(checkpoints, "get_checkpoints", lambda: store)
+
+    async def attempt(spent: bool) -> str:
+        current_run_id.set("run-1")
+        budget = Budget(max_searches=1)
+        budget.searches = 1 if spent else 0
+        run_budget.set(budget)
+        return await call(web_search, {"query": "solid state batteries"})
+
+    assert asyncio.run(attempt(spent=True)) == SEARCH_STOPPED
+    # The resumed run has a fresh budget, the stopped search runs instead of being replayed
+    assert "[Source](" in asyncio.run(attempt(spent=False))
+
+def test_search_budget_drops_the_queries_over_it():
+    async def search() -> str:
+        run_budget.set(Budget(max_searches=2))
+        return await call(web_search_many, {"queries": ["solar panels", "wind turbines", "heat pumps"]})
+
+    output = asyncio.run(search())
+    assert "## solar panels" in output and "## wind turbines" in output
+    assert "heat pumps" not in output
+
+def test_requirements_of_a_previous_message_are_not_reused():
+    context = Info(name="test_user", interests=["AI"], requirements=Requirements(topic="an older question", focus_areas=[], constraints=[]))
+    # Out of tokens, the run goes straight to the forced synthesis, which must not answer the older question
+    result = asyncio.run(run_research(lead_agent, "What is a heat pump?", context, budget=Budget(max_tokens=1)))
+    assert context.requirements is None
+    assert "older question" not in str(result.final_output)
+
+def test_prefetched_searches_are_charged_to_the_budget():
+    async def prefetch():
+        budget = Budget(max_searches=2)
+        run_budget.set(budget)
+        prefetcher = Prefetcher(lambda query: asyncio.sleep(0, result=[]), max_queries=4)
+        queries = prefetcher.start("Compare solar panels, wind turbines and heat pumps for homes")
+        assert len(queries) == 2 and budget.searches == 2
+        # A tool served from the prefetch charged its search itself, the prefetched one is given back
+        await prefetcher.lookup(queries[0])
+        assert budget.searches == 1
+        prefetcher.cancel()
+
+    asyncio.run(prefetch())
@@ -0,0 +1,25 @@
+import asyncio
+
+import checkpoints
+from checkpoints import CheckpointStore, checkpointed, current_run_id
+from web_search import SEARCH_FAILED, all_searches_succeeded
+
+
+def test_output_with_failed_searches_is_searched_again(tmp_path, monkeypatch):
+    store = CheckpointStore(str(tmp_path / "checkpoints.db"))
+    monkeypatch.setattr(checkpoints, "get_checkpoints", lambda: store)
+    calls = []
+
+    @checkpointed(complete=all_searches_succeeded)
+    async def search(query: str) -> str:
+        calls.append(query)
+        return f"{SEARCH_FAILED} 429 Too Many Requests" if len(calls) == 1 else f"results of {query}"
+
+    async def attempts():
+        current_run_id.set("run-1")
+        return [await search("solar"), await search("solar"), await search("solar")]
+
+    outputs = asyncio.run(attempts())
+    # The failed output was not checkpointed, the successful one is replayed
+    assert outputs[1:] == ["results of solar", "results of solar"]
+    assert len(calls) == 2
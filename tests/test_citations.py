@@ -0,0 +1,29 @@
+from citations import normalize_url, verify_citations
+
+WIKIPEDIA = "https://en.wikipedia.org/wiki/Python_(programming_language)"
+
+
+def sources(*results: dict) -> dict:
+    return {normalize_url(result["url"]): result for result in results}
+
+
+def test_code_and_parentheses_of_the_prose_are_kept():
+    answer = "Start the event loop with `asyncio.run()` (see the docs) before any task is created."
+    text, report = verify_citations(answer, sources({"url": "https://docs.python.org/3/library/asyncio.html", "title": "", "content": ""}))
+    assert "`asyncio.run()`" in text
+    assert "(see the docs)" in text
+
+
+def test_dropped_source_link_leaves_no_empty_parentheses():
+    answer = "Python was first released by Guido van Rossum in the year 1991 ([Source](https://fake.example/python))."
+    text, report = verify_citations(answer, sources({"url": WIKIPEDIA, "title": "Python", "content": "released 1991"}))
+    assert report.stripped == 1
+    assert "()" not in text and "fake.example" not in text
+
+
+def test_url_with_parentheses_is_supported():
+    answer = f"Python was first released by Guido van Rossum in the year 1991 ([Wikipedia]({WIKIPEDIA}))."
+    source = {"url": WIKIPEDIA, "title": "Python (programming language)", "content": "Python was first released in 1991 by Guido van Rossum."}
+    text, report = verify_citations(answer, sources(source))
+    assert text == answer
+    assert (report.supported, report.stripped, report.attached) == (1, 0, 0)
@@ -0,0 +1,22 @@
+from compaction import compact_results, split_passages, PASSAGE_WORDS
+
+
+def unpunctuated(topic: str, words: int = 1500) -> str:
+    return " ".join(f"{topic} word{i % 50}" for i in range(words // 2))
+
+
+def test_content_without_punctuation_is_split_by_words():
+    passages = split_passages(unpunctuated("battery"))
+    assert len(passages) > 1
+    assert all(len(passage.split()) <= PASSAGE_WORDS for passage in passages)
+
+
+def test_every_result_keeps_a_passage_within_the_budget():
+    results = [
+        {"title": topic, "url": f"https://example.com/{topic}", "content": unpunctuated(topic)}
+        for topic in ("battery", "solar", "wind")
+    ]
+    compacted, stats = compact_results("battery storage", results, token_budget=300)
+    assert [result["url"] for result in compacted] == [result["url"] for result in results]
+    assert all(result["content"] for result in compacted)
+    assert stats["compacted_tokens"] <= 300
@@ -0,0 +1,42 @@
+import time
+import asyncio
+
+from agents import RunConfig
+
+from research_agents import requirement_gathering_agent
+from research_pipeline import run_research
+from hooks import DeepResearchHooks
+from tools import Info
+
+CHATS = 4
+
+
+async def research(index: int) -> tuple[float, float]:
+    """One chat researching its own question, returns when it started and finished."""
+    started_at = time.perf_counter()
+    await run_research(
+        starting_agent=requirement_gathering_agent,
+        input=f"Analyze the latest developments of topic {index} in renewable energy",
+        context=Info(name=f"test_user_{index}", interests=["AI"]),
+        run_config=RunConfig(workflow_name="Test", tracing_disabled=True),
+        hooks=DeepResearchHooks(run_id=f"test-chat-{index}"),
+    )
+    return started_at, time.perf_counter()
+
+
+async def research_concurrently(chats: int) -> list[tuple[float, float]]:
+    return await asyncio.gather(*(research(index) for index in range(chats)))
+
+
+def test_concurrent_chats_make_progress_in_parallel():
+    alone_started, alone_finished = asyncio.run(research(CHATS))
+    alone = alone_finished - alone_started
+
+    started_at = time.perf_counter()
+    spans = asyncio.run(research_concurrently(CHATS))
+    wall_time = time.perf_counter() - started_at
+
+    # Every chat started before any of them finished, so their runs overlap
+    assert max(start for start, _ in spans) < min(end for _, end in spans)
+    # and the chats together take about as long as one, not CHATS times as long
+    assert wall_time < alone * CHATS / 2
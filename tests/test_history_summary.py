@@ -0,0 +1,110 @@
+import json
+import asyncio
+
+from agents.memory import SessionABC
+
+import history_summary
+from compaction import estimate_tokens
+from history_summary import SummarizingSession, refreshes, summaries
+
+
+class ListSession(SessionABC):
+    """Session kept in a list, like the stores it keeps every item."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.items = []
+
+    async def get_items(self, limit=None):
+        return self.items[-limit:] if limit else list(self.items)
+
+    async def add_items(self, items):
+        self.items.extend(items)
+
+    async def pop_item(self):
+        return self.items.pop() if self.items else None
+
+    async def clear_session(self):
+        self.items.clear()
+
+
+def fake_turn(turn: int) -> list[dict]:
+    """A research turn: the question, a search call with a large output and the answer."""
+    return [
+        {"role": "user", "content": f"Question {turn}: tell me more about topic {turn} " * 3},
+        {"type": "function_call", "call_id": f"call_{turn}", "name": "web_search", "arguments": json.dumps({"query": f"topic {turn}"})},
+        {"type": "function_call_output", "call_id": f"call_{turn}", "output": f"Search result about topic {turn}. " * 200},
+        {"role": "assistant", "content": f"Answer about topic {turn} with [Source](https://example.com/{turn}). " * 20},
+    ]
+
+
+def test_history_is_summarized_in_the_background():
+    async def chat() -> tuple[list, list]:
+        release = asyncio.Event()
+
+        async def slow_summarizer(previous_summary: str, items: list[dict]) -> str:
+            await release.wait()
+            return f"summary of {len(items)} items"
+
+        inner = ListSession("summary-test")
+        for turn in range(6):
+            inner.items.extend(fake_turn(turn))
+        session = SummarizingSession(inner, token_budget=2000, summarizer=slow_summarizer)
+        # The summarizer is blocked, the history is still given at once, without a summary yet
+        before = await asyncio.wait_for(session.get_items(), 1)
+        release.set()
+        await refreshes["summary-test"]
+        after = await session.get_items()
+        await session.clear_session()
+        return before, after
+
+    before, after = asyncio.run(chat())
+    assert before[0]["role"] == "user"
+    assert after[0]["role"] == "system" and "summary of 12 items" in after[0]["content"]
+    assert after[1:] == before
+
+
+def test_replayed_history_stays_within_the_budget_over_100_turns():
+    async def chat() -> tuple[list[int], int]:
+        calls = 0
+
+        async def fake_summarizer(previous_summary: str, items: list[dict]) -> str:
+            # The real summary agent is asked for at most 200 words
+            nonlocal calls
+            calls += 1
+            return (previous_summary + f" +{len(items)} items")[-800:]
+
+        session = SummarizingSession(ListSession("budget-test"), token_budget=4000, summarizer=fake_summarizer)
+        sizes = []
+        for turn in range(100):
+            replayed = await session.get_items()
+            sizes.append(sum(estimate_tokens(item) for item in replayed))
+            await session.add_items(fake_turn(turn))
+        await session.clear_session()
+        return sizes, calls
+
+    sizes, calls = asyncio.run(chat())
+    assert max(sizes) <= 4000
+    # Only the turns that left the window are summarized, once each
+    assert 0 < calls <= 100
+
+
+def test_summaries_of_the_least_recently_used_sessions_are_dropped(monkeypatch):
+    monkeypatch.setattr(history_summary, "HISTORY_MAX_SESSIONS", 2)
+
+    async def summarizer(previous_summary: str, items: list[dict]) -> str:
+        return "summary"
+
+    async def chats():
+        for index in range(3):
+            session = SummarizingSession(ListSession(f"lru-test-{index}"), token_budget=2000, summarizer=summarizer)
+            for turn in range(4):
+                await session.add_items(fake_turn(turn))
+            await refreshes[session.session_id]
+        # The finished refreshes are not kept either
+        await asyncio.sleep(0)
+        assert not any(session_id.startswith("lru-test") for session_id in refreshes)
+
+    asyncio.run(chats())
+    assert [session_id for session_id in summaries if session_id.startswith("lru-test")] == ["lru-test-1", "lru-test-2"]
+    summaries.clear()
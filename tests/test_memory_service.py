@@ -0,0 +1,16 @@
+import asyncio
+
+from memory_service import MemoryService, LocalMemoryBackend
+
+
+def test_search_returns_the_same_shape_with_and_without_pending_saves():
+    async def searches() -> tuple[dict, dict]:
+        service = MemoryService(backend=LocalMemoryBackend())
+        before = await service.search("test_user", "favorite language")
+        await service.save("test_user", "My favorite language is Python")
+        after = await service.search("test_user", "favorite language")
+        return before, after
+
+    before, after = asyncio.run(searches())
+    assert before == {"results": [], "pending": []}
+    assert after == {"results": [], "pending": ["My favorite language is Python"]}
@@ -0,0 +1,27 @@
+from plan_cache import PlanCache
+from research_agents import Requirements
+
+
+def requirements(timeframe: str, topic: str = "market outlook of solid state batteries for electric vehicles in europe") -> Requirements:
+    return Requirements(
+        topic=topic,
+        focus_areas=["leading manufacturers and their production capacity", "cost per kwh compared to lithium ion"],
+        constraints=[f"timeframe: {timeframe}", "format: report"],
+    )
+
+
+def test_plan_of_another_timeframe_is_not_reused():
+    cache = PlanCache()
+    cache.put(requirements("2023"), "plan for 2023")
+    assert cache.get(requirements("2023")) == "plan for 2023"
+    assert cache.get(requirements("2024")) is None
+    assert cache.get(requirements("2019")) is None
+
+
+def test_plan_of_a_similar_topic_with_the_same_constraints_is_reused():
+    cache = PlanCache(similarity=0.8)
+    cache.put(requirements("2023"), "plan for 2023")
+    similar_topic = "market outlook of solid state batteries for electric vehicles across europe"
+    assert cache.get(requirements("2023", topic=similar_topic)) == "plan for 2023"
+    assert cache.similar_hits == 1
+    assert cache.get(requirements("2024", topic=similar_topic)) is None
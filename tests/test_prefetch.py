@@ -0,0 +1,24 @@
+import asyncio
+
+from research_agents import requirement_gathering_agent
+from research_pipeline import run_research
+from prefetch import prefetch_metrics
+from router import route, CONTINUATION
+from tools import Info
+
+REPLY = "yes, focus on Europe and the last two years"
+
+
+def launched_by(prefetch: bool) -> int:
+    before = prefetch_metrics.totals["launched"]
+    context = Info(name="test_user", interests=["AI"])
+    asyncio.run(run_research(requirement_gathering_agent, REPLY, context, prefetch=prefetch))
+    return prefetch_metrics.totals["launched"] - before
+
+
+def test_answer_to_the_requirement_gathering_agent_is_not_prefetched():
+    decision = route(REPLY, previous_agent=requirement_gathering_agent.name)
+    assert decision.reason == CONTINUATION
+    assert launched_by(prefetch=decision.reason != CONTINUATION) == 0
+    # The same message as a new question is prefetched
+    assert launched_by(prefetch=True) > 0
@@ -1,16 +1,15 @@
 from agents import RunContextWrapper , function_tool 
 from dataclasses import dataclass
-import os 
-from mem0 import MemoryClient
 from agents.tool_context import ToolContext
-mem0_api_key =os.getenv("MEM0_API_KEY")
-mem_client = MemoryClient(api_key=mem0_api_key)
-import chainlit as cl 
+from memory_service import memory_service
 
 @dataclass
 class Info:
     name: str
     interests: [str]
+    fresh_plan: bool = False  # skip the plan cache and let the Planning Agent plan again
+    requirements: object = None  # Requirements given to the Planning Agent in the current run
+    run_id: str | None = None  # the stages of the run are checkpointed under it, see checkpoints.py
     
 @function_tool
 # @cl.step(type="GET Info Tool")
@@ -29,13 +28,15 @@ def sanitize_user_id(raw_user_id: str) -> str:
 async def search_user_memory(context: ToolContext[Info], query: str):
     """Use this tool to search user memories."""
     user_id = sanitize_user_id(context.context.name)
-    response = mem_client.search(query=query, user_id=user_id, top_k=10)
+    # Cached per user and run in a worker thread, so the event loop is not blocked
+    response = await memory_service.search(user_id, query, top_k=10)
     return response
 
 @function_tool
 async def save_user_memory(context:ToolContext[Info], query: str):
     """Use this tool to save user memories."""
     user_id = sanitize_user_id(context.context.name)
-    response = mem_client.add([{"role": "user", "content": query}], user_id=user_id)
+    # Queued and saved in batches, see memory_service.MemoryService.flush
+    response = await memory_service.save(user_id, query)
     return response
 
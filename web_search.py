@@ -1,25 +1,90 @@
 import os 
-import chainlit as cl
-from dotenv import load_dotenv, find_dotenv
-from tavily import AsyncTavilyClient
-load_dotenv(find_dotenv())
+import sys
+import asyncio
+import functools
+from clients import clients
+from search_cache import get_search_cache
+from corpus import get_corpus
+from checkpoints import checkpointed
+from citations import record_sources
+from prefetch import run_prefetcher
+from budget import allow_searches, SEARCH_STOPPED
+from compaction import compact_results
+from rate_limiter import limiters, with_retries
 from agents import function_tool
-tavily_api_key = os.getenv("TAVILY_API_KEY")
-if not tavily_api_key:
-    raise ValueError("Tavily API key is not set. Please ensure TAVILY_API_KEY is defined in your .env file.")
+from settings import getenv
 
-# Initialize Tavily client for web search
-tavily_client = AsyncTavilyClient(api_key=tavily_api_key)
-# --- Tool Definitions ---    
-@function_tool 
-@cl.step(type="Web Search Tool")
-async def web_search(query: str):
-    """Search the web using Tavily."""
-    response = await tavily_client.search(query)
+SEARCH_FAILED = "Search failed:"
+
+# Maximum number of Tavily requests running at the same time for one web_search_many call
+WEB_SEARCH_CONCURRENCY = int(getenv("WEB_SEARCH_CONCURRENCY", 5))
+
+def chainlit_step(type: str):
+    """Like cl.step, but the step is only shown inside a chainlit chat, so the tool also works from the CLI and benchmarks.
+    chainlit is not imported here, it is only used when the app already runs in it."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if "chainlit" not in sys.modules:
+                return await func(*args, **kwargs)
+            import chainlit as cl
+            from chainlit.context import get_context, ChainlitContextException
+            try:
+                get_context()
+            except ChainlitContextException:
+                return await func(*args, **kwargs)
+            return await cl.step(type=type)(func)(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def search_budget(func):
+    """Tool decorator: charges the searches of the call to the budget of the run and drops the queries over it.
+    It wraps the checkpoints, so a search stopped by the budget is never checkpointed and replayed on resume."""
+    @functools.wraps(func)
+    async def wrapper(queries, *args, **kwargs):
+        many = isinstance(queries, list)
+        allowed = allow_searches(len(queries) if many else 1)
+        if not allowed:
+            return SEARCH_STOPPED
+        return await func(queries[:allowed] if many else queries, *args, **kwargs)
+    return wrapper
+
+async def tavily_search(query: str) -> dict:
+    """Searches Tavily through the shared cache and rate limiter."""
+    return await get_search_cache().get_or_fetch(
+        query, lambda: with_retries(lambda: clients.get("tavily").search(query), limiters["tavily"])
+    )
+
+async def search_sources(query: str) -> list[dict]:
+    """Results of the query from the local corpus when it has enough fresh and relevant ones, otherwise from Tavily.
+    The Tavily results are added to the corpus."""
+    corpus = get_corpus()
+    results = await asyncio.to_thread(corpus.lookup, query) if corpus else None
+    if results:
+        print(f"📚 SYSTEM: '{query}' answered from the local corpus ({len(results)} results)")
+        return results
+    results = (await tavily_search(query))['results']
+    if corpus:
+        await asyncio.to_thread(corpus.add, query, results)
+    return results
+
+async def search_results(query: str) -> list[dict]:
+    """Results of the query for the search tools, from the prefetched searches of the run when one matches.
+    All the results are added to the sources the citations are checked against."""
+    prefetcher = run_prefetcher.get()
+    results = await prefetcher.lookup(query) if prefetcher else None
+    if results:
+        print(f"🚀 SYSTEM: '{query}' served from the prefetched searches")
+    else:
+        results = await search_sources(query)
+    record_sources(results)
+    return results
 
+def format_results(results: list[dict]) -> str:
+    """Formats the Tavily results as markdown with the source link of each result."""
     formatted_results = []
     
-    for result in response['results']:
+    for result in results:
         result_text = f"""
 ### {result['title']}
 {result['content']}
@@ -29,10 +94,58 @@ async def web_search(query: str):
         formatted_results.append(result_text)
     
     # Join all results and send as one message
-    all_results = "\n".join(formatted_results)
-    return all_results
+    return "\n".join(formatted_results)
 
+def all_searches_succeeded(output: str) -> bool:
+    """A resumed run searches the failed queries again, so an output with failures is not checkpointed."""
+    return SEARCH_FAILED not in output
 
-    
+def compact(query: str, results: list[dict]) -> list[dict]:
+    """Keeps the most relevant passages of the results within the token budget and reports the saving."""
+    results, stats = compact_results(query, results)
+    if stats["saved_tokens"]:
+        print(f"✂️ SYSTEM: search results for '{query}' compacted from {stats['original_tokens']} "
+              f"to {stats['compacted_tokens']} tokens (saved {stats['saved_tokens']})")
+    return results
+
+# --- Tool Definitions ---    
+@function_tool 
+@search_budget
+@checkpointed
+@chainlit_step(type="Web Search Tool")
+async def web_search(query: str):
+    """Search the web using Tavily."""
+    # Served from the local corpus or the cache when possible, see search_results
+    results = await search_results(query)
+    return format_results(compact(query, results))
+
+@function_tool
+@search_budget
+@checkpointed(complete=all_searches_succeeded)
+@chainlit_step(type="Web Search Many Tool")
+async def web_search_many(queries: list[str]):
+    """Search the web using Tavily for several queries at once. Use it to run all the queries of a research plan in one call."""
+    semaphore = asyncio.Semaphore(WEB_SEARCH_CONCURRENCY)
+
+    async def search_one(query: str):
+        async with semaphore:
+            return await search_results(query)
+
+    responses = await asyncio.gather(*(search_one(query) for query in queries), return_exceptions=True)
+
+    sections = []
+    seen_urls = set()
+    for query, response in zip(queries, responses):
+        # A failed query is reported in the output instead of failing the whole batch
+        if isinstance(response, Exception):
+            sections.append(f"## {query}\n{SEARCH_FAILED} {response}\n")
+            continue
+        # Drop the results that were already returned for a previous query
+        results = [result for result in response if result['url'] not in seen_urls]
+        seen_urls.update(result['url'] for result in results)
+        if results:
+            sections.append(f"## {query}\n{format_results(compact(query, results))}")
+        else:
+            sections.append(f"## {query}\nNo new results.\n")
 
-        
\ No newline at end of file
+    return "\n".join(sections)